@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+import timeindex
+
+# Pre-aggregated day x type x metric cube for the histogram and summary
+# table. Every cell keeps mergeable statistics of one metric for the rows of
+# one day and one type:
+#   count, sum, sum of squares   (of the value minus the metric's origin)
+#   min, max
+#   hist                         counts in FINE_BINS fixed-width bins over the
+#                                metric's overall range; datetime metrics use
+#                                DAY_BINS minute bins within the cell's day
+# A date range and type subset is answered by summing the cells of the whole
+# days inside the range over the selected types; the part-days at either end
+# are aggregated from their rows the same way (a binary search and a slice
+# of the time-sorted frame) and merged in. The browser merges the fine bins
+# into a histogram of any coarser bin count (assets/histogram.js). The
+# quartiles of a selection of at most EXACT_ROWS values are computed from its
+# rows, as pandas' describe does; for larger ones they are read off the fine
+# bins, so they are exact to within one fine bin (a thousandth of the
+# metric's range, or a minute), and nothing scans the selected rows.
+FINE_BINS = 1000
+EXACT_ROWS = 100_000
+DAY_BINS = 1440
+NS_PER_DAY = 86_400 * 1_000_000_000
+DAY = np.timedelta64(1, 'D')
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+class Cube:
+    # `df` sorted by `time_col` (see timeindex.sort_by_time)
+    def __init__(self, df, time_col, type_col, metrics):
+        self.df = df
+        self.time_col = time_col
+        self.type_col = type_col
+        self.metrics = list(metrics)
+        self.types = list(pd.unique(df[type_col]))
+        self.is_time = {m: np.issubdtype(df[m].dtype, np.datetime64) for m in self.metrics}
+        self.origin = {}
+        self.width = {}
+        for m in self.metrics:
+            # Values are kept as offsets from the metric's minimum; a datetime
+            # minimum is an integer ns, so the offsets stay exact in float64
+            if self.is_time[m]:
+                lo = df[m].min()
+                self.origin[m] = 0 if pd.isna(lo) else pd.Timestamp(lo).value
+            else:
+                lo = df[m].min()
+                self.origin[m] = 0.0 if pd.isna(lo) else float(lo)
+            values = self._values(df, m)
+            hi = np.nanmax(values) if np.any(~np.isnan(values)) else 0.0
+            self.width[m] = hi / FINE_BINS if hi > 0 else 1.0
+        self.cells = self._aggregate(df)
+        self.days = self.cells['days']
+
+    # float64 values of a metric minus its origin; datetimes in ns
+    def _values(self, frame, metric):
+        values = frame[metric].to_numpy()
+        if self.is_time[metric]:
+            ns = values.astype('datetime64[ns]').view('int64')
+            return np.where(ns == np.iinfo('int64').min, np.nan, (ns - self.origin[metric]).astype('float64'))
+        return values.astype('float64') - self.origin[metric]
+
+    # Cell statistics of `frame`: arrays of shape (days, types[, bins]) per metric
+    def _aggregate(self, frame):
+        t = frame[self.time_col].to_numpy().astype('datetime64[ns]')
+        days, day_idx = np.unique(t.astype('datetime64[D]'), return_inverse=True)
+        type_idx = pd.Categorical(frame[self.type_col], categories=self.types).codes
+        n_days, n_types = len(days), len(self.types)
+        n = n_days * n_types
+        cell = day_idx * n_types + type_idx
+        cells = {'days': days.astype('datetime64[ns]'),
+                 'rows': np.bincount(cell, minlength=n).reshape(n_days, n_types)}
+        for m in self.metrics:
+            values = self._values(frame, m)
+            valid = ~np.isnan(values)
+            c = cell[valid]
+            x = values[valid]
+            low = np.full(n, np.inf)
+            high = np.full(n, -np.inf)
+            np.minimum.at(low, c, x)
+            np.maximum.at(high, c, x)
+            if self.is_time[m]:
+                since_midnight = x + (self.origin[m] - days.astype('datetime64[ns]').view('int64')[day_idx[valid]])
+                bins, b = DAY_BINS, (since_midnight * DAY_BINS // NS_PER_DAY).astype('int64')
+            else:
+                bins, b = FINE_BINS, (x // self.width[m]).astype('int64')
+            b = np.clip(b, 0, bins - 1)
+            cells[m] = {
+                'count': np.bincount(c, minlength=n).reshape(n_days, n_types),
+                'sum': np.bincount(c, weights=x, minlength=n).reshape(n_days, n_types),
+                'sumsq': np.bincount(c, weights=x * x, minlength=n).reshape(n_days, n_types),
+                'min': low.reshape(n_days, n_types),
+                'max': high.reshape(n_days, n_types),
+                'hist': np.bincount(c * bins + b, minlength=n * bins).reshape(n_days, n_types, bins),
+            }
+        return cells
+
+    # Statistics of the rows with start <= time <= end (None: open) and a type
+    # in `types` (None: all), as a Selection
+    def select(self, start=None, end=None, types=None):
+        start = None if start is None else pd.Timestamp(start).to_datetime64().astype('datetime64[ns]')
+        end = None if end is None else pd.Timestamp(end).to_datetime64().astype('datetime64[ns]')
+        # Whole days are [first_full, past_full); the rest comes from rows
+        first_full = None if start is None else start.astype('datetime64[D]').astype('datetime64[ns]')
+        if first_full is not None and first_full < start:
+            first_full = first_full + DAY
+        past_full = None if end is None else (end + np.timedelta64(1, 'ns')).astype('datetime64[D]').astype('datetime64[ns]')
+
+        parts = []
+        if first_full is not None and past_full is not None and first_full >= past_full:
+            parts.append(self._aggregate(timeindex.between(self.df, self.time_col, start, end)))
+        else:
+            i = 0 if first_full is None else int(np.searchsorted(self.days, first_full, side='left'))
+            j = len(self.days) if past_full is None else int(np.searchsorted(self.days, past_full, side='left'))
+            parts.append(_slice_days(self.cells, self.metrics, i, j))
+            if first_full is not None and start < first_full:
+                head = timeindex.between(self.df, self.time_col, start, first_full - np.timedelta64(1, 'ns'))
+                parts.append(self._aggregate(head))
+            if past_full is not None and past_full <= end:
+                parts.append(self._aggregate(timeindex.between(self.df, self.time_col, past_full, end)))
+
+        keep = [t for t in self.types if types is None or t in types]
+        mask = np.array([t in keep for t in self.types], dtype=bool)
+        return Selection(self, parts, keep, mask, start, end)
+
+
+def _slice_days(cells, metrics, i, j):
+    part = {'days': cells['days'][i:j], 'rows': cells['rows'][i:j]}
+    for m in metrics:
+        part[m] = {k: v[i:j] for k, v in cells[m].items()}
+    return part
+
+
+# Merged statistics of a cube selection
+class Selection:
+    def __init__(self, cube, parts, types, mask, start=None, end=None):
+        self.cube = cube
+        self.parts = [p for p in parts if len(p['days'])]
+        self.types = types
+        self.mask = mask
+        self.start = start
+        self.end = end
+
+    def rows(self):
+        return int(sum(p['rows'][:, self.mask].sum() for p in self.parts))
+
+    def _moments(self, metric):
+        cells = [p[metric] for p in self.parts]
+        count = sum(int(c['count'][:, self.mask].sum()) for c in cells)
+        total = sum(float(c['sum'][:, self.mask].sum()) for c in cells)
+        sumsq = sum(float(c['sumsq'][:, self.mask].sum()) for c in cells)
+        low = min([float(c['min'][:, self.mask].min()) for c in cells if c['min'][:, self.mask].size] or [np.inf])
+        high = max([float(c['max'][:, self.mask].max()) for c in cells if c['max'][:, self.mask].size] or [-np.inf])
+        return count, total, sumsq, low, high
+
+    # Fine bins of one metric over the selection, in order: (bin positions
+    # on one grid, their left edges as offsets from the metric's origin, bin
+    # width, counts per selected type)
+    def _fine(self, metric):
+        cube = self.cube
+        if not self.parts:
+            return np.empty(0, 'int64'), np.empty(0), 1.0, np.zeros((len(self.types), 0), 'int64')
+        if not cube.is_time[metric]:
+            counts = sum(p[metric]['hist'][:, self.mask].sum(axis=0) for p in self.parts)
+            position = np.arange(FINE_BINS)
+            return position, cube.width[metric] * position, cube.width[metric], counts
+        # Datetimes: the occupied minute bins of each selected day, placed on
+        # one timeline of minutes since the first day
+        first = min(p['days'][0] for p in self.parts)
+        positions, counts = [], []
+        for p in self.parts:
+            hist = p[metric]['hist'][:, self.mask].transpose(1, 0, 2).reshape(len(self.types), -1)
+            occupied = np.flatnonzero(hist.any(axis=0))
+            offset = ((p['days'] - first) // DAY).astype('int64') * DAY_BINS
+            positions.append(offset[occupied // DAY_BINS] + occupied % DAY_BINS)
+            counts.append(hist[:, occupied])
+        position = np.concatenate(positions)
+        order = np.argsort(position, kind='stable')
+        width = NS_PER_DAY / DAY_BINS
+        start = first.astype('int64') - cube.origin[metric]
+        return position[order], start + width * position[order], width, \
+            np.concatenate(counts, axis=1)[:, order]
+
+    # Occupied fine bins of one metric for a histogram: (left edge of bin
+    # position 0, on the metric's own scale (ns for datetimes), bin width,
+    # positions, {type: counts}); see figures.histogram_data
+    def fine_bins(self, metric):
+        position, edges, width, counts = self._fine(metric)
+        occupied = counts.sum(axis=0) > 0
+        start = self.cube.origin[metric] + (edges[0] - width * position[0] if len(position) else 0.0)
+        return start, width, position[occupied], {t: c[occupied] for t, c in zip(self.types, counts)}
+
+    # Non-NaN values of one metric for the selected rows, minus its origin
+    def _values(self, metric):
+        cube = self.cube
+        rows = timeindex.between(cube.df, cube.time_col, self.start, self.end)
+        rows = rows[rows[cube.type_col].isin(self.types)]
+        values = cube._values(rows, metric)
+        return values[~np.isnan(values)]
+
+    # pandas-describe statistics of one metric: count, mean, std, min,
+    # quartiles and max (Timestamps for datetime metrics, without std)
+    def describe(self, metric):
+        count, total, sumsq, low, high = self._moments(metric)
+        origin = self.cube.origin[metric]
+        # Offsets from the origin until the end
+        stats = {'count': float(count)}
+        if count:
+            mean = total / count
+            var = max(sumsq / count - mean * mean, 0.0) * count / (count - 1) if count > 1 else np.nan
+            if count <= EXACT_ROWS:
+                quantiles = list(np.quantile(self._values(metric), QUANTILES))
+            else:
+                _, edges, width, fine = self._fine(metric)
+                quantiles = _quantiles(edges, width, fine.sum(axis=0), count, low, high)
+            stats.update({'mean': mean, 'std': np.sqrt(var), 'min': low})
+            stats.update({f'{q:.0%}': v for q, v in zip(QUANTILES, quantiles)})
+            stats['max'] = high
+        else:
+            stats.update({k: np.nan for k in ['mean', 'std', 'min', '25%', '50%', '75%', 'max']})
+        if self.cube.is_time[metric]:
+            stats = {k: v if k == 'count' else pd.Timestamp(origin + round(v)) if np.isfinite(v) else pd.NaT
+                     for k, v in stats.items() if k != 'std'}
+        else:
+            stats = {k: v if k in ('count', 'std') else v + origin for k, v in stats.items()}
+        return pd.Series(stats, name=metric)
+
+
+# Quantiles from fine-bin counts, interpolating linearly within a bin and
+# clipped to the exact min and max
+def _quantiles(edges, width, counts, count, low, high):
+    cum = np.cumsum(counts)
+    out = []
+    for q in QUANTILES:
+        rank = q * (count - 1)
+        b = int(np.searchsorted(cum, rank, side='right'))
+        before = cum[b - 1] if b else 0
+        inside = (rank - before + 0.5) / counts[b]
+        out.append(float(np.clip(edges[b] + inside * width, low, high)))
+    return out
@@ -0,0 +1,150 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Memoised callback results. A callback wrapped with CallbackCache.memoize()
+# is keyed on the data version and its normalised inputs; a repeated view is
+# answered from an in-memory LRU bounded by the pickled size of its entries,
+# and, if a directory is given, from a disk tier (diskcache, imported only
+# then) that survives restarts. Entries of any other data version are dropped
+# from memory as soon as the version changes and age out of the disk tier.
+# stats() counts, per memoised callback, how often it actually ran and for
+# how long.
+MAX_BYTES = 256 * 1024 * 1024
+DISK_BYTES = 1024 * 1024 * 1024
+
+
+# Data version from the size and mtime of source files (missing ones count too)
+def file_version(*paths):
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f'{path}:{st.st_size}:{st.st_mtime_ns}')
+        except OSError:
+            parts.append(f'{path}:missing')
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+# Hashable form of a callback input; lists named in `unordered` (checklist
+# values, whose order is just the order they were clicked in) are sorted
+def normalize(value, unordered=False):
+    if isinstance(value, (list, tuple)):
+        items = tuple(normalize(v) for v in value)
+        return tuple(sorted(items, key=repr)) if unordered else items
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize(v)) for k, v in value.items()))
+    return value
+
+
+class CallbackCache:
+    def __init__(self, max_bytes=MAX_BYTES, directory=None, disk_bytes=DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.version = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.computed = {}
+        self.disk = None
+        if directory:
+            import diskcache
+            self.disk = diskcache.Cache(directory, size_limit=disk_bytes)
+
+    # Forget everything in memory (the disk tier is keyed on the version, so
+    # it needs no clearing for a new one)
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _check_version(self, version):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.bytes = 0
+                self.version = version
+
+    def _remember(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    # Cached value for `key` under data `version`, computing it with fn()
+    # on a miss
+    def get(self, version, key, fn):
+        self._check_version(version)
+        key = (version, key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        disk_key = hashlib.sha1(repr(key).encode()).hexdigest() if self.disk is not None else None
+        blob = self.disk.get(disk_key) if disk_key else None
+        if blob is not None:
+            with self.lock:
+                self.disk_hits += 1
+            value = pickle.loads(blob)
+        else:
+            with self.lock:
+                self.misses += 1
+            value = fn()
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if disk_key:
+                self.disk.set(disk_key, blob)
+        self._remember(key, value, len(blob))
+        return value
+
+    # Decorator for a callback: `version` is a zero-argument callable giving
+    # the current data version (e.g. data.get_version), `unordered` names the
+    # arguments whose list order doesn't matter. Put it below @app.callback.
+    def memoize(self, version, unordered=()):
+        def decorate(callback):
+            signature = inspect.signature(callback)
+
+            @functools.wraps(callback)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                key = (callback.__name__,) + tuple(
+                    (name, normalize(value, name in unordered))
+                    for name, value in bound.arguments.items())
+
+                def compute():
+                    began = time.perf_counter()
+                    value = callback(*args, **kwargs)
+                    self._count(callback.__name__, time.perf_counter() - began)
+                    return value
+                return self.get(version(), key, compute)
+            return wrapper
+        return decorate
+
+    def _count(self, name, seconds):
+        with self.lock:
+            runs, total, worst = self.computed.get(name, (0, 0.0, 0.0))
+            self.computed[name] = (runs + 1, total + seconds, max(worst, seconds))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else None,
+                    'entries': len(self.entries), 'bytes': self.bytes,
+                    'max_bytes': self.max_bytes, 'disk': self.disk is not None,
+                    'computed': {name: {'runs': runs, 'mean_ms': 1000 * total / runs, 'max_ms': 1000 * worst}
+                                 for name, (runs, total, worst) in self.computed.items()}}
@@ -1,3 +1,4 @@
+import os
 import warnings
 import sqlite3
 from datetime import date
@@ -5,39 +6,75 @@ import pandas as pd
 import plotly.express as px
 import dash
 from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ClientsideFunction
 import wrangle
+import lazydata
+import figures
+import callbackcache
+import timeindex
+import aggcube
+import sharedframes
 
 # Suppress warnings
 warnings.simplefilter("ignore", UserWarning)
 
 # Input data path
 file_path = "../data/synthetic_data.db"
-
-# Wrangle the data
-df = wrangle.wrangle(file_path)
+# Session store (sessionstore.py) to read the Babolat rows from instead of
+# the database; it must have been ingested from this same data. None reads
+# the database
+Store_path = None
+
+
+# Size and mtime of the database, and of the store's marks when one is used
+def data_version():
+    if Store_path:
+        return callbackcache.file_version(file_path, os.path.join(Store_path, 'marks.json'))
+    return callbackcache.file_version(file_path)
+
+# Set to a directory to keep cached callback results across restarts
+Cache_path = None
+# The wrangled data is published here once and memory-mapped by every
+# gunicorn worker (see sharedframes.py); None, as when run directly, wrangles
+# it in each process instead
+Shared_path = "/dev/shm/BabDash" if sharedframes.under_gunicorn() else None
+# The dashboard's code, which versions the shared data along with the
+# sources, so editing the wrangling or merging republishes it
+code_version = sharedframes.code_version(os.path.dirname(os.path.abspath(__file__)))
+
+# Wrangle the data in the background so the layout is served straight away,
+# sorted by time for the date filter, or attach the shared copy; the source
+# version keys both and the callback cache
+data = lazydata.LazyData(
+    lambda: sharedframes.load(Shared_path, f'{data_version()}|{code_version}',
+                              lambda: timeindex.sort_by_time(wrangle.wrangle(file_path, store=Store_path), 'time')),
+    version=data_version)
+
+# Columns summarised in the stats table
+metrics = ['time', 'StyleScore', 'StyleValue', 'EffectScore', 'EffectValue', 'SpeedScore', 'SpeedValue', 'stroke_counter']
+
+# Day x type aggregates of every metric, built once the data is loaded; the
+# histogram and stats table are answered from these instead of the rows
+cube = lazydata.LazyData(lambda: aggcube.Cube(data.get(), 'time', 'type', metrics),
+                         version=data.get_version)
+
+# Results of update_output per (data version, inputs); hit rate at /cache-stats
+cache = callbackcache.CallbackCache(directory=Cache_path)
 
 # Session and calculation fields for axis selection (update with your relevant columns)
 calc = ['StyleScore', 'StyleValue', 'EffectScore', 'EffectValue', 'SpeedScore', 'SpeedValue', 'time']
 
-# Pre-process the time column to datetime format (for faster filtering)
-df['time'] = pd.to_datetime(df['time'])
-
-# App setup
+# App setup; `server` is the WSGI app for gunicorn (main:server)
 app = dash.Dash(__name__)
+server = app.server
 
 # Layout
 app.layout = html.Div([
     html.H1("Tennis Sensor Data Dashboard"),
+    dcc.Location(id='url'),
 
-    # Date picker for selecting range
-    dcc.DatePickerRange(
-        id='date-picker',
-        min_date_allowed=df['time'].min().date(),
-        max_date_allowed=df['time'].max().date(),
-        start_date=df['time'].min().date(),
-        end_date=df['time'].max().date(),
-    ),
+    # Date picker for selecting range (bounds filled in once the data is loaded)
+    dcc.DatePickerRange(id='date-picker'),
 
     # Dropdown for x-axis selection
     html.Label("X-axis metric"),
@@ -61,13 +98,13 @@ app.layout = html.Div([
     html.Label("Type"),
     dcc.Checklist(
         id='type-checklist',
-        options=[{'label': t, 'value': t} for t in df['type'].unique()],
-        value=df['type'].unique(),  # Default to all selected
+        options=[],
+        value=[],
         inline=True
     ),
 
     # Scatter plot
-    dcc.Graph(id='scatter-plot'),
+    dcc.Loading(dcc.Graph(id='scatter-plot')),
 
     # Histogram bin slider
     html.Label("Number of Bins for Histogram"),
@@ -80,57 +117,79 @@ app.layout = html.Div([
         marks={i: str(i) for i in range(5, 101, 10)}
     ),
 
-    # Histogram plot
-    dcc.Graph(id='histogram-plot'),
+    # Histogram plot, re-binned in the browser from the fine bins in the store
+    dcc.Store(id='histogram-data'),
+    dcc.Loading(dcc.Graph(id='histogram-plot')),
 
     # Summary stats table
-    html.Div(id='summary-stats', style={'margin-top': '20px'})
+    dcc.Loading(html.Div(id='summary-stats', style={'margin-top': '20px'}))
 ])
 
+# Fill in the data-dependent controls on page load; the plots wait for these
+@app.callback(
+    [Output('date-picker', 'min_date_allowed'),
+     Output('date-picker', 'max_date_allowed'),
+     Output('date-picker', 'start_date'),
+     Output('date-picker', 'end_date'),
+     Output('type-checklist', 'options'),
+     Output('type-checklist', 'value')],
+    [Input('url', 'pathname')]
+)
+def populate_controls(pathname):
+    df = data.get()
+    first, last = df['time'].min().date(), df['time'].max().date()
+    # In the order they first appear in the source: the frame is in time
+    # order, and its index is the wrangled frame's row order
+    types = df.sort_index(kind='stable')['type'].unique().tolist()
+    return first, last, first, last, [{'label': t, 'value': t} for t in types], types  # Default to all selected
+
 # Callback for updating scatter plot, histogram, and stats
 @app.callback(
     [Output('scatter-plot', 'figure'),
-     Output('histogram-plot', 'figure'),
+     Output('histogram-data', 'data'),
      Output('summary-stats', 'children')],
     [Input('date-picker', 'start_date'),
      Input('date-picker', 'end_date'),
      Input('x-axis-dropdown', 'value'),
      Input('y-axis-dropdown', 'value'),
-     Input('type-checklist', 'value'),
-     Input('bin-slider', 'value')]
+     Input('type-checklist', 'value')]
 )
-def update_output(start_date, end_date, x_axis, y_axis, selected_types, num_bins):
-    # Convert start_date and end_date to datetime format
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    # Filter by date range and type (optimized filtering)
-    filtered_df = df[
-        (df['time'] >= start_date) &
-        (df['time'] <= end_date) &
-        (df['type'].isin(selected_types))
-    ]
+@cache.memoize(data.get_version, unordered=('selected_types',))
+def update_output(start_date, end_date, x_axis, y_axis, selected_types):
+    df = data.get()
+
+    # Slice the date range out of the time-sorted frame, then filter by type
+    # within the slice only
+    filtered_df = timeindex.between(df, 'time', start_date, end_date)
+    filtered_df = filtered_df[filtered_df['type'].isin(selected_types)]
 
     # Scatter plot with dynamic x-axis and y-axis
     scatter_fig = px.scatter(
         filtered_df,
+        render_mode=figures.render_mode(len(filtered_df)),  # WebGL for large selections
         x=x_axis,
         y=y_axis,
         color="type",
         title=f"Scatter plot of {x_axis} vs {y_axis}"
     )
 
-    # Histogram plot with adjustable number of bins and color by type
-    histogram_fig = px.histogram(
-        filtered_df,
-        x=x_axis,  # Use x-axis for histogram x-axis
-        nbins=num_bins,
-        color="type",  # Color by 'type'
-        title=f"Histogram of {y_axis} with {num_bins} bins"
+    # Histogram and summary stats from the cube: bin counts per type and
+    # merged moments, without going through the selected rows
+    selection = cube.get().select(start_date, end_date, selected_types)
+
+    # Histogram fine bins by type; the bin slider re-bins them client-side
+    start, width, position, counts = selection.fine_bins(x_axis)
+    histogram_data = figures.histogram_data(
+        start, width, position, counts,
+        title=f"Histogram of {y_axis} with {{bins}} bins",
+        is_time=cube.get().is_time[x_axis],
+        xaxis_title=x_axis,  # Use x-axis for histogram x-axis
+        legend_title_text="type"  # Color by 'type'
     )
 
     # Summary stats (updated with relevant columns)
-    summary_stats = filtered_df[["time", "type", "spin", "StyleScore", "StyleValue", "EffectScore", "EffectValue", "SpeedScore", "SpeedValue", "stroke_counter"]].describe()
+    summary_stats = pd.DataFrame({m: selection.describe(m) for m in metrics}).reindex(
+        ['count', 'mean', 'min', '25%', '50%', '75%', 'max', 'std'])
 
     # Dash DataTable for summary stats
     summary_table = dash_table.DataTable(
@@ -139,9 +198,23 @@ def update_output(start_date, end_date, x_axis, y_axis, selected_types, num_bins
         style_table={'overflowX': 'scroll'}
     )
 
-    return scatter_fig, histogram_fig, summary_table
+    return scatter_fig, histogram_data, summary_table
+
+# Histogram with adjustable number of bins, built in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='histogram', function_name='rebin'),
+    Output('histogram-plot', 'figure'),
+    [Input('histogram-data', 'data'),
+     Input('bin-slider', 'value')]
+)
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return cache.stats()
 
 # Run the app
 if __name__ == '__main__':
+    data.start()
+    cube.start()
     app.run_server(debug=True)
 
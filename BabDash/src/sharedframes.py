@@ -0,0 +1,148 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# A dashboard's wrangled data, published once and attached by every server
+# process. With several gunicorn workers each would otherwise re-run the
+# wrangle and merge and hold its own copy of the frames; instead the first
+# worker to load builds the data and writes it under
+#   <path>/<version digest>/
+#       <name>.arrow    one uncompressed Arrow IPC file per DataFrame
+#       <name>.npy      one file per numpy array
+#       meta.json       the structure (nested dicts, scalars), written last
+# and every worker, that one included, memory-maps the files. Numeric and
+# datetime columns without nulls come back as pandas columns over the
+# mapped pages, so the workers share one copy through the page cache (on
+# /dev/shm, one copy in RAM) and memory stays flat as workers are added.
+# Float NaNs are kept as NaN values, not Arrow nulls, so they map too.
+# Object columns Arrow cannot type (mixed strings and floats) are pickled
+# into <name>.objects.pkl and put back in place when the frame is read.
+# An exclusive lock on <path>/lock makes the other workers wait for the
+# build instead of repeating it. A new version is built next to the old one,
+# which is then removed (processes still mapping it keep their pages). The
+# dashboards version it on their sources and on code_version(), so changing
+# the code that builds the data republishes it too. They share only under
+# gunicorn (under_gunicorn()); run directly, each process builds its own.
+
+
+# Whether this process was started by gunicorn, whose arbiter sets
+# SERVER_SOFTWARE to gunicorn/<version>
+def under_gunicorn():
+    return os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn/')
+
+
+# Digest of the code in `directory` (a dashboard's src): every .py file in it
+def code_version(directory):
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                h.update(name.encode() + b'\0' + f.read())
+    return h.hexdigest()
+
+
+def _digest(version):
+    return hashlib.sha1(str(version).encode()).hexdigest()[:16]
+
+
+def _arrow_typed(series):
+    try:
+        pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return False
+    return True
+
+
+def _table(df):
+    table = pa.Table.from_pandas(df)
+    for column in df.columns:
+        if df[column].dtype.kind == 'f':
+            i = table.schema.get_field_index(str(column))
+            table = table.set_column(i, table.schema.field(i),
+                                     pa.array(df[column].to_numpy(), from_pandas=False))
+    return table
+
+
+# Write `value` (a DataFrame, numpy array, JSON scalar, or a dict of those,
+# nested) under `directory`; returns its description for meta.json
+def _write(directory, name, value):
+    if isinstance(value, pd.DataFrame):
+        objects = [c for c in value.columns if value[c].dtype == object and not _arrow_typed(value[c])]
+        with pa.OSFile(os.path.join(directory, f'{name}.arrow'), 'wb') as sink:
+            table = _table(value.drop(columns=objects))
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        if not objects:
+            return {'frame': name}
+        value[objects].to_pickle(os.path.join(directory, f'{name}.objects.pkl'))
+        return {'frame': name, 'objects': [[value.columns.get_loc(c), str(c)] for c in objects]}
+    if isinstance(value, np.ndarray):
+        np.save(os.path.join(directory, f'{name}.npy'), value, allow_pickle=False)
+        return {'array': name}
+    if isinstance(value, dict):
+        return {'dict': {str(k): _write(directory, f'{name}.{k}', v) for k, v in value.items()}}
+    if isinstance(value, np.generic):
+        value = value.item()
+    return {'value': value}
+
+
+def _read(directory, entry):
+    if 'frame' in entry:
+        source = pa.memory_map(os.path.join(directory, entry['frame'] + '.arrow'))
+        df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+        if 'objects' in entry:
+            objects = pd.read_pickle(os.path.join(directory, entry['frame'] + '.objects.pkl'))
+            for loc, column in entry['objects']:
+                df.insert(loc, column, objects[column])
+        return df
+    if 'array' in entry:
+        return np.load(os.path.join(directory, entry['array'] + '.npy'), mmap_mode='r')
+    if 'dict' in entry:
+        return {k: _read(directory, v) for k, v in entry['dict'].items()}
+    return entry['value']
+
+
+def published(path, version):
+    return os.path.exists(os.path.join(path, _digest(version), 'meta.json'))
+
+
+def publish(path, version, value):
+    directory = os.path.join(path, _digest(version))
+    tmp = directory + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {'version': str(version), 'data': _write(tmp, 'data', value)}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp, directory)
+    for name in os.listdir(path):
+        if name not in (_digest(version), 'lock'):
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def attach(path, version):
+    directory = os.path.join(path, _digest(version))
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    return _read(directory, meta['data'])
+
+
+# The data for `version`: attached if it is published, otherwise built with
+# build() and published first (by one process; the others wait on the lock).
+# With no path the data is just built, as before.
+def load(path, version, build):
+    if not path:
+        return build()
+    if not published(path, version):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not published(path, version):
+                publish(path, version, build())
+    return attach(path, version)
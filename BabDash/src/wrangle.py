@@ -1,32 +1,45 @@
 import sqlite3
 import pandas as pd
-import pytz
+import timestamps
+import sqlquery
+
+# Columns selected by default
+COLUMNS = ['time', 'type', 'spin',
+           'StyleScore', 'StyleValue',
+           'EffectScore', 'EffectValue',
+           'SpeedScore', 'SpeedValue',
+           'stroke_counter']
 
 # Build your `wrangle` function here
-def wrangle(db_path):
+def wrangle(db_path, start_date=None, end_date=None, columns=None, store=None):
+    if columns is None:
+        columns = COLUMNS
+    columns = ['time'] + [c for c in columns if c != 'time']
+
+    # Serve from the columnar session store when it holds the Babolat sensor
+    if store:
+        import sessionstore
+        df = sessionstore.read_sensor(store, 'bab', start_date, end_date, columns)
+        if df is not None:
+            return from_store(df, columns)
+
     # Connect to database
     conn = sqlite3.connect(db_path)
 
-    # Construct query (You can modify the query as needed for your data)
-    query = """
-    SELECT time, type, spin, 
-    StyleScore, StyleValue, 
-    EffectScore, EffectValue,
-    SpeedScore, SpeedValue,
-    stroke_counter 
-    FROM SyntheticData
-    """
-
-    # Read query results into DataFrame
-    df = pd.read_sql(query, conn)
+    # Push the date window and projection down into SQLite (time is 1e-4 s ticks)
+    start_ticks = timestamps.local_to_epoch(start_date, '100us') if start_date else None
+    end_ticks = timestamps.local_to_epoch(end_date, '100us') if end_date else None
+    df = sqlquery.read_range(conn, 'SyntheticData', 'time', start_ticks, end_ticks, columns)
     
-    # Convert Unix timestamps to datetime objects and format
-    df['time'] = pd.to_datetime(df['time']/10000, unit='s')
-    az_timezone = pytz.timezone('America/Phoenix')
-    df['time'] = df['time'].dt.tz_localize('UTC').dt.tz_convert(az_timezone)
-    df['time'] = df['time'].dt.strftime('%m-%d-%Y %I:%M:%S %p')
+    # Convert 1e-4 s ticks to Phoenix local datetime64 in one step
+    df['time'] = timestamps.epoch_to_local(df['time'], '100us')
 
     conn.close()
     
     return df
 
+# Store rows -> the columns and dtypes the database query gives (the store
+# adds PIQ and keeps type and spin as categoricals)
+def from_store(df, columns):
+    df = df[columns]
+    return df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
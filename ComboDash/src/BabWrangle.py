@@ -1,25 +1,36 @@
 import sqlite3
-import pandas as pd
-import pytz
+import timestamps
+import sqlquery
+
+# Default projection, and the columns the PIQ score is built from
+COLUMNS = ['time', 'type', 'spin',
+           'StyleScore', 'StyleValue',
+           'EffectScore', 'EffectValue',
+           'SpeedScore', 'SpeedValue',
+           'stroke_counter']
+REQUIRED_COLUMNS = ['time', 'StyleScore', 'EffectScore', 'SpeedScore']
 
 # Build your `wrangle` function here
-def BabWrangle(db_path):
+def BabWrangle(db_path, start_date='2024-06-12', end_date='2024-06-14', columns=None, store=None):
+    # Always select the columns the PIQ score is built from
+    if columns is None:
+        columns = COLUMNS
+    columns = REQUIRED_COLUMNS + [c for c in columns if c not in REQUIRED_COLUMNS]
+
+    # Serve from the columnar session store when it holds this sensor
+    if store:
+        import sessionstore
+        df = sessionstore.read_sensor(store, 'bab', start_date, end_date, columns)
+        if df is not None:
+            return df
+
     # Connect to database
     conn = sqlite3.connect(db_path)
 
-    # Construct query
-    query = """
-    SELECT time, type, spin, 
-    StyleScore, StyleValue, 
-    EffectScore, EffectValue,
-    SpeedScore, SpeedValue,
-    stroke_counter 
-    FROM motions
-    """
-
-    # Read query results into DataFrame
-    # df = pd.read_sql(query, conn, index_col="time")
-    df = pd.read_sql(query, conn)
+    # Push the date window and projection down into SQLite (time is 1e-4 s ticks)
+    start_ticks = timestamps.local_to_epoch(start_date, '100us') if start_date else None
+    end_ticks = timestamps.local_to_epoch(end_date, '100us') if end_date else None
+    df = sqlquery.read_range(conn, 'motions', 'time', start_ticks, end_ticks, columns)
     # Remove HR outliers
     # df = df[df["AVGHR"] > 50]
     # Create duration column from timestamps
@@ -28,22 +39,28 @@ def BabWrangle(db_path):
 #    df.drop(["session_counter"])
     df = df.sort_index()  
     df = df.drop_duplicates()
-    df['time'] = pd.to_datetime(df['time']/10000, unit='s')
-    az_timezone = pytz.timezone('America/Phoenix')
-    df['time'] = df['time'].dt.tz_localize('UTC').dt.tz_convert(az_timezone)
-    df['time'] = df['time'].dt.strftime('%m-%d-%Y %I:%M:%S %p')
+    # Babolat ticks are 1e-4 s -> Phoenix local datetime64 in one step
+    df['time'] = timestamps.epoch_to_local(df['time'], '100us')
     #Add PIQ column
     df['PIQ'] = df['SpeedScore'] + df['StyleScore'] + df['EffectScore']
     df = df.sort_values("time")
 
-    # Select calibration session 6/13
-    mask = df['time'] > '06-12-24'
-    df = df[mask]
-    mask = df['time'] < '06-14-24'
-    df = df[mask]
-    df["time"] = pd.to_datetime(df["time"])
-    dfb = df
-    
+    # Calibration session 6/13 is the default window selected in the query
+
     conn.close()
     
     return df
+
+# Strokes recorded after the high-water mark `after_time` (1e-4 s ticks), and
+# the new mark. Every stroke loaded before is at or before the mark, so
+# keeping time > mark is what keeps them (and repeats of them) out of the
+# batch; drop_duplicates in BabWrangle only sees the batch itself.
+def BabSince(db_path, after_time, columns=None):
+    after = timestamps.epoch_to_local([after_time + 1], '100us')[0]
+    df = BabWrangle(db_path, after, '2100-01-01', columns)
+    ticks = (df['time'].to_numpy('datetime64[ns]').view('int64')
+             - timestamps.PHOENIX_OFFSET_NS) // timestamps.UNIT_NS['100us']
+    df = df[ticks > after_time].reset_index(drop=True)
+    if df.empty:
+        return df, after_time
+    return df, int(ticks.max())
@@ -1,28 +1,37 @@
 import sqlite3
 import pandas as pd
-import pytz
+import timestamps
+import sqlquery
+
+# Columns the derived fields below are built from
+REQUIRED_COLUMNS = ['l_id', 'swing_type', 'swing_side',
+                    'impact_position_x', 'impact_position_y']
 
 # Build your `wrangle` function here
-def UZeppWrangle(db_path):
+def UZeppWrangle(db_path, start_date='2024-06-12', end_date='2024-06-14', columns=None, store=None):
+    # Always select the columns the derived fields are built from
+    if columns is not None:
+        columns = REQUIRED_COLUMNS + [c for c in columns if c not in REQUIRED_COLUMNS]
+
+    # Serve from the columnar session store when it holds this sensor
+    if store:
+        import sessionstore
+        df = sessionstore.read_sensor(store, 'zepp', start_date, end_date, columns)
+        if df is not None:
+            return df
+
     # Connect to database
     conn = sqlite3.connect(db_path)
 
-    # Construct query
-    query = """
-    SELECT * 
-    FROM swings
-    """
-    # Read query results into DataFrame
-    # df = pd.read_sql(query, conn, index_col="time")
-    df = pd.read_sql(query, conn)
+    # Push the date window and projection down into SQLite (l_id is epoch ms)
+    start_ms = timestamps.local_to_epoch(start_date, 'ms') if start_date else None
+    end_ms = timestamps.local_to_epoch(end_date, 'ms') if end_date else None
+    df = sqlquery.read_range(conn, 'swings', 'l_id', start_ms, end_ms, columns)
     df = df.sort_index()  
     # df = df.drop_duplicates()
     
-    df['l_id'] = pd.to_datetime(df['l_id'], unit='ms')
-    az_timezone = pytz.timezone('America/Phoenix')
-    df['l_id'] = df['l_id'].dt.tz_localize('UTC').dt.tz_convert(az_timezone)
-    df['l_id'] = df['l_id'].dt.strftime('%m-%d-%Y %I:%M:%S %p')
-    df["l_id"] = pd.to_datetime(df["l_id"])
+    # Epoch ms -> Phoenix local datetime64 in one step
+    df['l_id'] = timestamps.epoch_to_local(df['l_id'], 'ms')
 
     df.dropna(inplace=True)
     df = df.sort_values("l_id")
@@ -39,16 +48,21 @@ def UZeppWrangle(db_path):
     # add new impact column
     df['diffxy'] = 0.5 * df['impact_position_x'] - df['impact_position_y']
 
-    # add to select comparison match on 6/13
+    # Date window (default: comparison match on 6/13) was applied in the query
     df.rename(columns = {'l_id' : 'time'}, inplace=True)
-    mask = df['time'] > '2024-06-12'
-    df = df[mask]
-    mask = df['time'] < '2024-06-14'
-    df = df[mask]
 
-    # Format with fractional seconds to match Apple Watch
-    df['timestamp'] = df['time'].dt.strftime('%m-%d-%Y %I:%M:%S.%f %p')
+    # Same clock as the Apple Watch `timestamp` column, kept as datetime64
+    df['timestamp'] = df['time']
 
     conn.close()
     
     return df
+
+# Swings recorded after the high-water mark `after_l_id` (epoch ms), wrangled
+# the same way, and the new mark
+def UZeppSince(db_path, after_l_id, columns=None):
+    after = timestamps.epoch_to_local([after_l_id + 1], 'ms')[0]
+    df = UZeppWrangle(db_path, after, '2100-01-01', columns)
+    if df.empty:
+        return df, after_l_id
+    return df, int(timestamps.local_to_epoch(df['time'].max(), 'ms'))
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from alignment import as_ns
+
+# As-of join of any number of sensor streams. Instead of merging whole frames
+# pairwise, each added stream is matched to the stream it joins `on` with one
+# vectorised searchsorted pass, and only an int64 row index per stream is
+# kept (-1 where nothing is within tolerance). Payload columns are gathered
+# through those indices when a frame is asked for, so memory is one index
+# per stream plus whatever columns are requested, and a further sensor costs
+# one more index rather than another full-frame merge.
+#
+# Matching follows pd.merge_asof: 'backward' takes the last row at or before
+# the key, 'forward' the first at or after, and 'nearest' the closer of the
+# two, preferring backward on ties.
+class AsOfJoin:
+    # `frame` is the base stream: one output row per row of it, in its order
+    def __init__(self, name, frame, time_col):
+        self.base = name
+        self.frames = {name: frame}
+        self.times = {name: as_ns(frame[time_col])}
+        self.parent = {name: None}
+        self.local = {name: None}
+
+    # Match each row of stream `on` (the base by default) to a row of `frame`.
+    # `times` is a column name or an array of the stream's times, already moved
+    # onto the reference clock (see alignment.shift_times); offset_s is a
+    # further constant offset subtracted from them.
+    def add(self, name, frame, times, tolerance, on=None, offset_s=0.0, direction='nearest'):
+        on = self.base if on is None else on
+        right = as_ns(frame[times] if isinstance(times, str) else times)
+        right = right - int(round(offset_s * 1_000_000_000))
+        self.frames[name] = frame
+        self.times[name] = right
+        self.parent[name] = on
+        tolerance_ns = None if tolerance is None else pd.Timedelta(tolerance).value
+        self.local[name] = asof_index(self.times[on], right, tolerance_ns, direction)
+        return self
+
+    # Row of stream `name` for each row of `base` (an ancestor of it, the
+    # join's base by default), composing the per-stream indices along the way
+    def index(self, name, base=None):
+        base = self.base if base is None else base
+        idx = np.arange(len(self.frames[name]))
+        while name != base:
+            if self.parent[name] is None:
+                raise ValueError(f"{base} is not joined to {name}")
+            local = self.local[name]
+            idx = np.where(local >= 0, idx[local], -1) if len(idx) else np.full(len(local), -1)
+            name = self.parent[name]
+        return idx
+
+    # Which rows of `base` have a match in stream `name`
+    def matched(self, name, base=None):
+        return self.index(name, base) >= 0
+
+    # One stream's column on the output rows, missing where unmatched
+    def column(self, name, col, base=None):
+        return gather(self.frames[name][col], self.index(name, base))
+
+    # Requested columns, {stream: [columns]}, as one frame with a row per row of
+    # `base`. A name already taken by an earlier stream gets a _<stream> suffix.
+    def frame(self, columns, base=None):
+        out = {}
+        for name, cols in columns.items():
+            idx = self.index(name, base)
+            for col in cols:
+                key = col if col not in out else f'{col}_{name}'
+                out[key] = gather(self.frames[name][col], idx)
+        return pd.DataFrame(out)
+
+
+# Index into `right` for each of `left` (-1 if none within tolerance_ns;
+# None means no limit)
+def asof_index(left, right, tolerance_ns=None, direction='nearest'):
+    if direction not in ('backward', 'forward', 'nearest'):
+        raise ValueError(f"direction must be 'backward', 'forward' or 'nearest', not {direction!r}")
+    n = len(right)
+    if n == 0:
+        return np.full(len(left), -1)
+    order = None
+    if np.any(right[1:] < right[:-1]):
+        order = np.argsort(right, kind='stable')
+        right = right[order]
+    limit = np.inf if tolerance_ns is None else tolerance_ns
+
+    bwd = np.searchsorted(right, left, side='right') - 1
+    fwd = np.searchsorted(right, left, side='left')
+    bwd_gap = np.where(bwd >= 0, left - right[np.maximum(bwd, 0)], np.inf)
+    fwd_gap = np.where(fwd < n, right[np.minimum(fwd, n - 1)] - left, np.inf)
+    if direction == 'backward':
+        fwd_gap[:] = np.inf
+    elif direction == 'forward':
+        bwd_gap[:] = np.inf
+    idx = np.where(fwd_gap < bwd_gap, fwd, bwd)
+    gap = np.minimum(bwd_gap, fwd_gap)
+    idx[np.isinf(gap) | (gap > limit)] = -1
+    if order is not None:
+        idx = np.where(idx >= 0, order[np.maximum(idx, 0)], -1)
+    return idx
+
+
+# series[idx] with -1 giving the column's missing value (NaN, NaT, ...)
+def gather(series, idx):
+    values = series.to_numpy() if isinstance(series.dtype, np.dtype) else series.array
+    values = pd.api.extensions.take(values, idx, allow_fill=True)
+    return pd.Series(values, name=series.name)
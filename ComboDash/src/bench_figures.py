@@ -0,0 +1,67 @@
+import sys
+import time
+import numpy as np
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+import figures
+
+# Scatter figures of 10k, 100k and 1M points as SVG (go.Scatter) and WebGL
+# (go.Scattergl). Measures what the server spends on each (building the figure
+# through figures.Traces and serialising it, as Dash does) and writes
+# bench_figures.html, a self-contained page (plotly.js inlined, data generated
+# in the page) that times Plotly.newPlot in the browser, until the next
+# animation frame, for the same cases. Open it in the browser the dashboards
+# are used with; browser render time can't be taken from Python.
+# Usage: python3 bench_figures.py [out.html]
+SIZES = [10_000, 100_000, 1_000_000]
+out_path = sys.argv[1] if len(sys.argv) > 1 else 'bench_figures.html'
+
+print(f"{'points':>10} {'trace':>10} {'build s':>9} {'json s':>9} {'json MB':>9}")
+rng = np.random.default_rng(0)
+for n in SIZES:
+    x = rng.normal(size=n)
+    y = rng.normal(size=n)
+    for threshold in [n, 0]:
+        traces = figures.Traces(threshold=threshold)
+        t0 = time.perf_counter()
+        fig = go.Figure()
+        trace = traces.add(fig, 'sensor', x, y, mode='markers')
+        t1 = time.perf_counter()
+        payload = fig.to_json()
+        t2 = time.perf_counter()
+        print(f"{n:>10,} {trace.type:>10} {t1 - t0:>9.3f} {t2 - t1:>9.3f} {len(payload) / 1e6:>9.1f}")
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Scatter render times</title>
+<script>%(plotlyjs)s</script></head>
+<body><pre id="out">points      trace       render ms
+</pre><div id="plot" style="width:900px;height:500px"></div>
+<script>
+const sizes = %(sizes)s;
+const out = document.getElementById('out');
+const plot = document.getElementById('plot');
+const frame = () => new Promise(resolve => requestAnimationFrame(() => resolve()));
+async function run() {
+  for (const n of sizes) {
+    const x = new Float64Array(n), y = new Float64Array(n);
+    for (let i = 0; i < n; i++) { x[i] = Math.random(); y[i] = Math.random(); }
+    for (const type of ['scatter', 'scattergl']) {
+      Plotly.purge(plot);
+      await frame();
+      const t0 = performance.now();
+      await Plotly.newPlot(plot, [{type: type, mode: 'markers', x: x, y: y}]);
+      await frame();
+      const ms = performance.now() - t0;
+      out.textContent += String(n).padEnd(12) + type.padEnd(12) + ms.toFixed(0) + '\\n';
+      console.log(n, type, ms);
+    }
+  }
+  out.textContent += 'done\\n';
+}
+run();
+</script></body></html>
+"""
+
+with open(out_path, 'w') as f:
+    f.write(PAGE % {'plotlyjs': get_plotlyjs(), 'sizes': SIZES})
+print(f"browser render timings: open {out_path}")
@@ -0,0 +1,43 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pytz
+import timestamps
+
+# Compare the old strftime/re-parse round trip against timestamps.epoch_to_local
+# on a synthetic 100 Hz WristMotion-sized column.
+# Usage: python3 bench_timestamps.py [rows]
+n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+start_ns = pd.Timestamp('2024-06-13 14:00', tz='UTC').value
+raw = pd.Series(start_ns + np.arange(n_rows, dtype='int64') * 10_000_000)
+
+
+def old_path(values):
+    ts = pd.to_datetime(values, unit='ns')
+    ts = ts.dt.tz_localize('UTC').dt.tz_convert(pytz.timezone('America/Phoenix'))
+    ts = ts.dt.strftime('%m-%d-%Y %I:%M:%S.%f %p')
+    return pd.to_datetime(ts, format='%m-%d-%Y %I:%M:%S.%f %p')
+
+
+def new_path(values):
+    return pd.Series(timestamps.epoch_to_local(values, 'ns'))
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(raw)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+old_s, old_result = best_of(old_path, 1)
+new_s, new_result = best_of(new_path, 5)
+assert (old_result.to_numpy() == new_result.to_numpy()).all()
+
+print(f"rows:              {n_rows:,}")
+print(f"strftime/re-parse: {old_s:.3f} s")
+print(f"epoch_to_local:    {new_s:.4f} s")
+print(f"speedup:           {old_s / new_s:,.0f}x")
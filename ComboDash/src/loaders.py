@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Run a small graph of loading/merging steps concurrently. `tasks` maps a
+# step name to (function, [names of the steps it needs]); the function is
+# called with those steps' results, in order, as soon as they are ready.
+# Dependencies must be listed before the steps that use them.
+#
+# Threads are enough here: sqlite3 and the pandas CSV parser release the GIL
+# for most of their work, and results are shared without pickling.
+def run_tasks(tasks):
+    start = time.perf_counter()
+    timings = {}
+    futures = {}
+    # One worker per step so a step waiting on its inputs never starves another
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        for name, (fn, deps) in tasks.items():
+            inputs = [futures[dep] for dep in deps]
+            futures[name] = pool.submit(_run_step, name, fn, inputs, start, timings)
+        results = {name: future.result() for name, future in futures.items()}
+    timings['total'] = (0.0, time.perf_counter() - start)
+    return results, timings
+
+
+def _run_step(name, fn, inputs, start, timings):
+    args = [future.result() for future in inputs]
+    began = time.perf_counter()
+    result = fn(*args)
+    ended = time.perf_counter()
+    timings[name] = (began - start, ended - start)
+    return result
+
+
+# Per-step start/finish offsets and durations, in the order steps finished
+def format_timings(timings):
+    lines = [f"{'step':<16}{'start':>8}{'end':>8}{'took':>8}"]
+    for name, (began, ended) in sorted(timings.items(), key=lambda item: item[1][1]):
+        lines.append(f"{name:<16}{began:>7.2f}s{ended:>7.2f}s{ended - began:>7.2f}s")
+    return '\n'.join(lines)
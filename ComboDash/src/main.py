@@ -1,74 +1,189 @@
+import functools
+import logging
+import os
 import warnings
 import sqlite3
 from datetime import date
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import dash
 from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ClientsideFunction
 import UZeppWrangle
 import WatchWrangle
 import BabWrangle
-import pytz
+import loaders
+import lazydata
+import alignment
+import swingwindows
+import asofjoin
+import scalers
+import figures
+import callbackcache
+import timeindex
+import sharedframes
 import numpy as np
 
 # Suppress warnings
 warnings.simplefilter("ignore", UserWarning)
 
+# Clock-offset estimates and load timings; shown when run directly
+log = logging.getLogger(__name__)
+
 # Path for all three sensors
 Apple_path = "/home/blueaz/Downloads/SensorDownload/Compare/WristMotion.csv"
 Bab_path = "/home/blueaz/Python/Sensors/Bab/BabWrangle/src/BabPopExt.db"
 UZepp_path = "/home/blueaz/Downloads/SensorDownload/Compare/ztennis.db"
+# Columnar store built by `python3 sessionstore.py ingest`; raw sources are used if absent
+Store_path = "/home/blueaz/Downloads/SensorDownload/SessionStore"
+
+start_date = '2024-06-12'
+end_date = '2024-06-14'
+# Set to a directory to keep cached callback results across restarts
+Cache_path = None
+# The loaded data is published here once and memory-mapped by every
+# gunicorn worker (see sharedframes.py); None, as when run directly, loads
+# it in each process instead
+Shared_path = "/dev/shm/ComboDash" if sharedframes.under_gunicorn() else None
+# The dashboard's code, which versions the shared data along with the
+# sources, so editing the wrangling or merging republishes it
+code_version = sharedframes.code_version(os.path.dirname(os.path.abspath(__file__)))
+
+# The sources' sizes and mtimes, the loaded date window and the fallback
+# clock offsets version the data, for the shared copy, the callback cache and
+# the fitted ranges
+def data_version():
+    return '{}|{}..{}|{:+g}/{:+g}'.format(callbackcache.file_version(Apple_path, Bab_path, UZepp_path),
+                                          start_date, end_date, bab_shift, watch_shift)
+
+# Fitted min/max ranges, kept next to the session store (when there is one)
+# so a restart on the same data skips the scans
+scaler_registry = scalers.ScalerRegistry(os.path.join(Store_path, 'scalers.json'), version=data_version)
 
 # Data wrangling functions
-def normalize_column(dfa, dfb, ref_col, norm_col, new_col_name):
-    min_A = dfa[ref_col].min()
-    max_A = dfa[ref_col].max()
-    min_B = dfb[norm_col].min()
-    max_B = dfb[norm_col].max()
-    def normalize(x, min_B, max_B, min_A, max_A):
-        return ((x - min_B) * (max_A - min_A) / (max_B - min_B)) + min_A
-    dfb[new_col_name] = dfb[norm_col].apply(normalize, args=(min_B, max_B, min_A, max_A))
-
-# Load and process data
-dfa = WatchWrangle.WatchWrangle(Apple_path) 
-dfb = BabWrangle.BabWrangle(Bab_path) 
-dfu = UZeppWrangle.UZeppWrangle(UZepp_path)
+# Rescale dfb[norm_col] onto the range of dfa[ref_col]; `sources` names the
+# sensors the two frames come from
+def normalize_column(dfa, dfb, ref_col, norm_col, new_col_name, sources):
+    scalers.normalize_column(scaler_registry, dfa, dfb, ref_col, norm_col, new_col_name,
+                             sources, f'{start_date}..{end_date}')
 
 # Process Zepp U sensor data
-normalize_column(dfb, dfu, 'EffectScore', 'ball_spin', 'ZIQspin')
-normalize_column(dfb, dfu, 'SpeedScore', 'racket_speed', 'ZIQspeed')
-absx = 0 - dfu['impact_position_x'].abs()
-absy = 0 - dfu['impact_position_y'].abs()
-dfu['abs_imp'] = 0 + (absx + absy)
-normalize_column(dfb, dfu, 'StyleScore', 'abs_imp', 'ZIQpos')
-dfu.loc[dfu['stroke'] != 'SERVEFH', 'ZIQspin'] = dfu['ZIQspin'] * 2
-dfu.loc[dfu['stroke'] != 'SERVEFH', 'ZIQspeed'] = dfu['ZIQspeed'] * 1.6 
-dfu['ZIQ'] = dfu['ZIQspeed'] + dfu['ZIQspin'] + dfu['ZIQpos']
-dfu.loc[dfu['stroke'] == 'SERVEFH', 'ZIQ'] = dfu['ZIQ'] * .9 
-dfu = dfu[dfu["dbg_acc_1"] < 10000]
-dfu = dfu[dfu["dbg_acc_3"] < 10000]
-dfu = dfu[dfu["ZIQ"] < 10000]
+def score_zepp(dfb, dfu):
+    normalize_column(dfb, dfu, 'EffectScore', 'ball_spin', 'ZIQspin', ('bab', 'zepp'))
+    normalize_column(dfb, dfu, 'SpeedScore', 'racket_speed', 'ZIQspeed', ('bab', 'zepp'))
+    absx = 0 - dfu['impact_position_x'].abs()
+    absy = 0 - dfu['impact_position_y'].abs()
+    dfu['abs_imp'] = 0 + (absx + absy)
+    normalize_column(dfb, dfu, 'StyleScore', 'abs_imp', 'ZIQpos', ('bab', 'zepp'))
+    dfu.loc[dfu['stroke'] != 'SERVEFH', 'ZIQspin'] = dfu['ZIQspin'] * 2
+    dfu.loc[dfu['stroke'] != 'SERVEFH', 'ZIQspeed'] = dfu['ZIQspeed'] * 1.6 
+    dfu['ZIQ'] = dfu['ZIQspeed'] + dfu['ZIQspin'] + dfu['ZIQpos']
+    dfu.loc[dfu['stroke'] == 'SERVEFH', 'ZIQ'] = dfu['ZIQ'] * .9 
+    dfu = dfu[dfu["dbg_acc_1"] < 10000]
+    dfu = dfu[dfu["dbg_acc_3"] < 10000]
+    dfu = dfu[dfu["ZIQ"] < 10000]
+    return dfu
 
 # Merge datasets
 tolerance = pd.Timedelta('5s')
-shift = 5 
-dfb['time'] = dfb['time'] - pd.Timedelta(seconds=shift) 
-dfu_dba_merge = pd.merge_asof(dfu, dfb, left_on='time', right_on='time', tolerance=tolerance, direction='nearest')
+# Clock offsets estimated by inspection; used for any session whose offset
+# can't be estimated with confidence from the data itself
+bab_shift = 5
+watch_shift = -1
+
+# Babolat stroke times moved onto the Zepp clock
+def align_bab(dfb, dfu):
+    estimates = alignment.estimate(dfu['time'], dfb['time'])
+    log.info(alignment.format_estimates('bab', estimates, bab_shift))
+    return alignment.shift_times(dfb['time'], estimates, bab_shift)
+
+# Move the watch samples onto the Zepp clock
+def align_watch(dfa, dfu):
+    # Impacts show up as spikes in the watch's acceleration magnitude
+    magnitude = np.sqrt(dfa['accelerationX'] ** 2 + dfa['accelerationY'] ** 2 + dfa['accelerationZ'] ** 2)
+    estimates = alignment.estimate(dfu['timestamp'], dfa['timestamp'], magnitude.to_numpy())
+    log.info(alignment.format_estimates('watch', estimates, watch_shift))
+    dfa['timestamp'] = alignment.shift_times(dfa['timestamp'], estimates, watch_shift)
+    return dfa
+
+# One as-of join for all three sensors: each watch sample to the nearest
+# swing, and each swing to the nearest Babolat stroke. Only row indices are
+# kept; columns are gathered by the frames built from it.
+def join_sensors(dfa, dfu, dfb, bab_time):
+    return (asofjoin.AsOfJoin('watch', dfa, 'timestamp')
+            .add('zepp', dfu, 'timestamp', tolerance)
+            .add('bab', dfb, bab_time, tolerance, on='zepp'))
+
+# Columns the plots and summary table use, per sensor
+merged_columns = {
+    'watch': ['timestamp', 'accelerationX'],
+    'zepp': ['ZIQ', 'ZIQspeed', 'ZIQspin', 'ZIQpos', 'ball_spin', 'racket_speed', 'dbg_acc_1', 'dbg_gyro_1'],
+}
+
+def merge_watch_zepp(join, dfu):
+    # Kept sorted by time for the date filters
+    df_merged = timeindex.sort_by_time(join.frame(merged_columns), 'timestamp')
 
-shift = -1 
-dfa['timestamp'] = pd.to_datetime(dfa['timestamp'])
-dfu['timestamp'] = pd.to_datetime(dfu['timestamp'])
-dfa['timestamp'] = dfa['timestamp'] - pd.Timedelta(seconds=shift) 
-df_merged = pd.merge_asof(dfa, dfu, left_on='timestamp', right_on='timestamp', tolerance=tolerance, direction='nearest')
+    # Normalize columns
+    normalize_column(dfu, df_merged, 'dbg_acc_1', 'accelerationX', 'AccXNorm1', ('zepp', 'watch'))
+    normalize_column(dfu, df_merged, 'dbg_gyro_1', 'accelerationX', 'Gyro1Norm1', ('zepp', 'watch'))
+    return df_merged
 
-# Normalize columns
-normalize_column(dfu, df_merged, 'dbg_acc_1', 'accelerationX', 'AccXNorm1')
-normalize_column(dfu, df_merged, 'dbg_gyro_1', 'accelerationX', 'Gyro1Norm1')
+# Every swing with its nearest Babolat stroke
+def merge_zepp_bab(join, dfu, dfb):
+    return join.frame({'zepp': list(dfu.columns), 'bab': [c for c in dfb.columns if c != 'time']}, base='zepp')
 
-# App setup
+# Watch channels around every Zepp impact: (swings x samples x channels)
+def swing_windows(dfa, dfu):
+    channels = [dfa[c].to_numpy() for c in WatchWrangle.CHANNELS]
+    windows, keep = swingwindows.extract(dfa['timestamp'], channels, dfu['timestamp'])
+    return {'windows': windows, 'time': dfu['timestamp'].to_numpy()[keep]}
+
+# Load the three sensors concurrently; each merge starts as soon as its inputs are ready
+zepp_columns = ['ball_spin', 'racket_speed', 'dbg_acc_1', 'dbg_acc_3', 'dbg_gyro_1']
+
+def load_data():
+    results, load_timings = loaders.run_tasks({
+        'watch': (lambda: WatchWrangle.WatchWrangle(Apple_path, start_date, end_date, store=Store_path), []),
+        'bab': (lambda: BabWrangle.BabWrangle(Bab_path, start_date, end_date, store=Store_path), []),
+        'zepp': (lambda: UZeppWrangle.UZeppWrangle(UZepp_path, start_date, end_date, zepp_columns, store=Store_path), []),
+        'zepp_scores': (score_zepp, ['bab', 'zepp']),
+        'bab_time': (align_bab, ['bab', 'zepp_scores']),
+        'watch_aligned': (align_watch, ['watch', 'zepp_scores']),
+        'join': (join_sensors, ['watch_aligned', 'zepp_scores', 'bab', 'bab_time']),
+        'zepp_bab_merge': (merge_zepp_bab, ['join', 'zepp_scores', 'bab']),
+        'df_merged': (merge_watch_zepp, ['join', 'zepp_scores']),
+        'swings': (swing_windows, ['watch_aligned', 'zepp_scores']),
+    })
+    log.info(loaders.format_timings(load_timings))
+    scaler_registry.save()
+    return {
+        'dfa': results['watch'],
+        'dfb': results['bab'],
+        'dfu': results['zepp_scores'],
+        'dfu_dba_merge': results['zepp_bab_merge'],
+        'df_merged': results['df_merged'],
+        'swings': results['swings'],
+    }
+
+# Loaded in the background so the layout is served straight away; attached
+# from the shared copy when it is up to date
+data = lazydata.LazyData(lambda: sharedframes.load(Shared_path, f'{data_version()}|{code_version}', load_data),
+                         version=data_version)
+
+# Results of the callbacks per (data version, inputs); hit rate and
+# per-callback run counts and times at /cache-stats
+cache = callbackcache.CallbackCache(directory=Cache_path)
+
+# Fine bins sent to the browser per histogram; the bin slider merges them
+Histogram_bins = 1000
+
+# Scatter traces, switched to WebGL above figures.WEBGL_POINTS points
+traces = figures.Traces()
+
+# App setup; `server` is the WSGI app for gunicorn (main:server)
 app = dash.Dash(__name__)
+server = app.server
 
 # Define available metrics for dropdowns
 metrics = ['AccXNorm1', 'Gyro1Norm1', 'ZIQ', 'ZIQspeed', 'ZIQspin', 'ZIQpos', 'ball_spin', 'racket_speed']
@@ -107,7 +222,7 @@ app.layout = html.Div([
         ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
     ]),
 
-    dcc.Graph(id='sensor-plot'),
+    dcc.Loading(dcc.Graph(id='sensor-plot')),
 
     html.Label("Number of Bins for Histogram"),
     dcc.Slider(
@@ -119,58 +234,131 @@ app.layout = html.Div([
         marks={i: str(i) for i in range(5, 101, 10)}
     ),
 
-    dcc.Graph(id='histogram-plot'),
+    dcc.Store(id='histogram-data'),
+    dcc.Loading(dcc.Graph(id='histogram-plot')),
 
-    html.Div(id='summary-stats', style={'margin-top': '20px'})
+    dcc.Loading(html.Div(id='summary-stats', style={'margin-top': '20px'})),
+
+    html.H1("Watch Signal Around Each Swing"),
+    dcc.Dropdown(
+        id='swing-channel-dropdown',
+        options=[{'label': col, 'value': col} for col in WatchWrangle.CHANNELS],
+        value='accelerationX',
+        clearable=False
+    ),
+    dcc.Loading(dcc.Graph(id='swing-window-plot'))
 ])
 
-# Correcting the input ID in the callback
+# The outputs below are separate callbacks, each run only when its own inputs
+# change: the sensor plot on the dates and both axes, the histogram on the
+# dates and the x axis, the summary table on the dates and both axes (and
+# there only for the columns that changed). They share the date-range
+# selection stage, computed once per date range and data version.
+
+# Rows of the selected date range, sliced out of the time-sorted frame; a
+# missing date leaves that end open
+@functools.lru_cache(maxsize=16)
+def _selection(version, start_date, end_date):
+    return timeindex.between(data.get()['df_merged'], 'timestamp', start_date or None, end_date or None)
+
+def selection(start_date, end_date):
+    return _selection(data.get_version(), start_date, end_date)
+
+# describe() of one column of a date-range selection
+@functools.lru_cache(maxsize=64)
+def _column_stats(version, start_date, end_date, column):
+    return _selection(version, start_date, end_date)[column].describe()
+
 @app.callback(
-    [Output('sensor-plot', 'figure'),
-     Output('histogram-plot', 'figure'),
-     Output('summary-stats', 'children')],
-    [Input('my-date-picker-range', 'start_date'),  # Update this ID
-     Input('my-date-picker-range', 'end_date'),    # Update this ID
+    Output('sensor-plot', 'figure'),
+    [Input('my-date-picker-range', 'start_date'),
+     Input('my-date-picker-range', 'end_date'),
      Input('x-axis-dropdown', 'value'),
-     Input('y-axis-dropdown', 'value'),
-     Input('bin-slider', 'value')]
+     Input('y-axis-dropdown', 'value')]
 )
-def update_output(start_date, end_date, x_axis, y_axis, num_bins):
-    # Convert start_date and end_date from strings to datetime objects
-    if start_date:
-        start_date = pd.to_datetime(start_date)
-    else:
-        start_date = df_merged['timestamp'].min()  # Default to min timestamp if no start date is provided
-    
-    if end_date:
-        end_date = pd.to_datetime(end_date)
-    else:
-        end_date = df_merged['timestamp'].max()  # Default to max timestamp if no end date is provided
-
-    # Filter the data based on selected date range
-    filtered_df = df_merged[
-        (df_merged['timestamp'] >= start_date) &
-        (df_merged['timestamp'] <= end_date)
-    ]
+@cache.memoize(data.get_version)
+def update_sensor_plot(start_date, end_date, x_axis, y_axis):
+    filtered_df = selection(start_date, end_date)
 
     # Generate sensor plot
     sensor_fig = go.Figure()
-    sensor_fig.add_trace(go.Scatter(x=filtered_df[x_axis], y=filtered_df[y_axis], mode='markers', name='Sensor Data'))
+    traces.add(sensor_fig, 'sensor', filtered_df[x_axis], filtered_df[y_axis], mode='markers', name='Sensor Data')
     sensor_fig.update_layout(title=f"{x_axis} vs {y_axis}", xaxis_title=x_axis, yaxis_title=y_axis)
 
-    # Generate histogram plot
-    histogram_fig = px.histogram(filtered_df, x=x_axis, nbins=num_bins, title=f"Histogram of {x_axis}")
+    # Long trace arrays go out as base64 typed arrays
+    return figures.encode(sensor_fig)
 
-    # Generate summary statistics
-    summary_stats = filtered_df[[x_axis, y_axis, 'ZIQ', 'ball_spin', 'racket_speed']].describe()
-    summary_table = dash_table.DataTable(
+@app.callback(
+    Output('histogram-data', 'data'),
+    [Input('my-date-picker-range', 'start_date'),
+     Input('my-date-picker-range', 'end_date'),
+     Input('x-axis-dropdown', 'value')]
+)
+@cache.memoize(data.get_version)
+def update_histogram(start_date, end_date, x_axis):
+    # Generate histogram fine bins; the bin slider re-bins them client-side
+    values = selection(start_date, end_date)[x_axis].dropna().to_numpy()
+    counts, edges = np.histogram(values, bins=Histogram_bins)
+    return figures.histogram_data(
+        edges[0], edges[1] - edges[0], np.flatnonzero(counts), {x_axis: counts[counts > 0]},
+        title=f"Histogram of {x_axis}", xaxis_title=x_axis)
+
+@app.callback(
+    Output('summary-stats', 'children'),
+    [Input('my-date-picker-range', 'start_date'),
+     Input('my-date-picker-range', 'end_date'),
+     Input('x-axis-dropdown', 'value'),
+     Input('y-axis-dropdown', 'value')]
+)
+@cache.memoize(data.get_version)
+def update_summary(start_date, end_date, x_axis, y_axis):
+    # Generate summary statistics, a column at a time
+    version = data.get_version()
+    columns = dict.fromkeys([x_axis, y_axis, 'ZIQ', 'ball_spin', 'racket_speed'])
+    summary_stats = pd.DataFrame({c: _column_stats(version, start_date, end_date, c) for c in columns})
+    return dash_table.DataTable(
         data=summary_stats.reset_index().to_dict('records'),
         columns=[{"name": i, "id": i} for i in summary_stats.reset_index().columns],
         style_table={'overflowX': 'scroll'}
     )
 
-    return sensor_fig, histogram_fig, summary_table
+# Histogram with adjustable number of bins, built in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='histogram', function_name='rebin'),
+    Output('histogram-plot', 'figure'),
+    [Input('histogram-data', 'data'),
+     Input('bin-slider', 'value')]
+)
+
+# Median and 10-90% band of one watch channel over the swings in the date range
+@app.callback(
+    Output('swing-window-plot', 'figure'),
+    [Input('my-date-picker-range', 'start_date'),
+     Input('my-date-picker-range', 'end_date'),
+     Input('swing-channel-dropdown', 'value')]
+)
+def update_swing_windows(start_date, end_date, channel):
+    swings = data.get()['swings']
+    swing_time = swings['time']
+    a, b = timeindex.span(swing_time, start_date or None, end_date or None)
+    values = swings['windows'][a:b, :, WatchWrangle.CHANNELS.index(channel)]
+
+    seconds = swingwindows.window_seconds()
+    fig = go.Figure()
+    if len(values):
+        low, median, high = np.percentile(values, [10, 50, 90], axis=0)
+        fig.add_trace(go.Scatter(x=seconds, y=high, mode='lines', line={'width': 0}, showlegend=False))
+        fig.add_trace(go.Scatter(x=seconds, y=low, mode='lines', line={'width': 0}, fill='tonexty', name='10-90%'))
+        fig.add_trace(go.Scatter(x=seconds, y=median, mode='lines', name='median'))
+    fig.update_layout(title=f"{channel} around {len(values)} swings", xaxis_title="Seconds from impact", yaxis_title=channel)
+    return fig
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return cache.stats()
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    data.start()
     app.run_server(debug=True)
 
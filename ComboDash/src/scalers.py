@@ -0,0 +1,69 @@
+import os
+import threading
+import numpy as np
+import watermarks
+
+# Fitted value ranges for min-max rescaling, cached per (source, column,
+# session) and optionally persisted as JSON. A range is either the column's
+# min/max or a pair of robust percentiles, and remembers how many rows it was
+# fitted on and the data version (if the registry is given a `version`
+# function): asking again for the same key with the same row count and
+# version returns the cached range without scanning the data.
+
+
+def key(source, column, session='all', percentiles=None):
+    kind = 'minmax' if percentiles is None else 'p{:g}-{:g}'.format(*percentiles)
+    return f'{source}/{column}/{session}/{kind}'
+
+
+class ScalerRegistry:
+    def __init__(self, path=None, version=None):
+        self.path = path
+        self.version = version
+        self.lock = threading.Lock()
+        self.params = watermarks.load(path) if path else {}
+        self.scans = 0
+
+    # (lo, hi) of `values`, fitted on first use and cached under the key
+    def range(self, source, column, values, session='all', percentiles=None):
+        k = key(source, column, session, percentiles)
+        version = self.version() if self.version else None
+        entry = self.params.get(k)
+        if entry is None or entry['rows'] != len(values) or entry.get('version') != version:
+            data = np.asarray(values, dtype='float64')
+            if percentiles is None:
+                lo, hi = np.nanmin(data), np.nanmax(data)
+            else:
+                lo, hi = np.nanpercentile(data, percentiles)
+            entry = {'lo': float(lo), 'hi': float(hi), 'rows': len(values), 'version': version}
+            with self.lock:
+                self.params[k] = entry
+                self.scans += 1
+        return entry['lo'], entry['hi']
+
+    # Persist the ranges, if the directory to keep them in exists
+    def save(self):
+        if not self.path or not os.path.isdir(os.path.dirname(self.path) or '.'):
+            return
+        with self.lock:
+            watermarks.save(self.path, self.params)
+
+
+# Map values linearly from the range `src` onto `dst` in one numpy expression
+def rescale(values, src, dst):
+    (src_lo, src_hi), (dst_lo, dst_hi) = src, dst
+    return (np.asarray(values, dtype='float64') - src_lo) * ((dst_hi - dst_lo) / (src_hi - src_lo)) + dst_lo
+
+
+# Undo rescale(values, src, dst)
+def inverse(values, src, dst):
+    return rescale(values, dst, src)
+
+
+# Add dfb[new_col_name]: dfb[norm_col] rescaled onto the range of dfa[ref_col].
+# `sources` names the two frames in the registry's keys.
+def normalize_column(registry, dfa, dfb, ref_col, norm_col, new_col_name,
+                     sources=('ref', 'norm'), session='all'):
+    ref = registry.range(sources[0], ref_col, dfa[ref_col], session)
+    src = registry.range(sources[1], norm_col, dfb[norm_col], session)
+    dfb[new_col_name] = rescale(dfb[norm_col].to_numpy(), src, ref)
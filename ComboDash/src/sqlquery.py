@@ -0,0 +1,40 @@
+import sqlite3
+import pandas as pd
+
+
+# Make sure range queries on `column` can use an index. An INTEGER PRIMARY KEY
+# is the rowid and already ordered; otherwise any index leading with the
+# column will do. Read-only databases just fall back to a table scan.
+def ensure_index(conn, table, column):
+    for _, name, col_type, _, _, pk in conn.execute(f"PRAGMA table_info({table})"):
+        if name == column and pk == 1 and col_type.upper() == 'INTEGER':
+            return
+    for index in conn.execute(f"PRAGMA index_list({table})"):
+        first = conn.execute(f"PRAGMA index_info({index[1]})").fetchone()
+        if first is not None and first[2] == column:
+            return
+    try:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})")
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass
+
+
+# Read only `columns` of the rows with `time_col` between `start` and `end`
+# (inclusive, in the column's own units). Either bound may be None.
+def read_range(conn, table, time_col, start=None, end=None, columns=None):
+    select = ', '.join(columns) if columns else '*'
+    query = f"SELECT {select} FROM {table}"
+    params = []
+    if start is not None and end is not None:
+        query += f" WHERE {time_col} BETWEEN ? AND ?"
+        params = [start, end]
+    elif start is not None:
+        query += f" WHERE {time_col} >= ?"
+        params = [start]
+    elif end is not None:
+        query += f" WHERE {time_col} <= ?"
+        params = [end]
+    if params:
+        ensure_index(conn, table, time_col)
+    return pd.read_sql(query, conn, params=params)
@@ -0,0 +1,23 @@
+import json
+import os
+
+# Persisted high-water marks, one entry per source:
+#   zepp  -> max swings.l_id already loaded (epoch ms)
+#   bab   -> max motions.time already loaded (1e-4 s ticks)
+#   watch -> byte offset of the first unread line of WristMotion.csv
+# A missing entry means nothing has been loaded from that source yet.
+
+
+def load(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Replace the file atomically so a crash never leaves half-written marks
+def save(path, marks):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(marks, f, indent=2)
+    os.replace(tmp, path)
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import pickle
+import diskcache
+import pandas as pd
+
+# Content-addressed store for the model-fitting stages. Each entry is keyed
+# on the digest of the data it was computed from plus the stage's own
+# parameters:
+#   frame    the wrangled frame                   (source file size and mtime,
+#                                                  wrangling code)
+#   design   OneHotEncoder + SimpleImputer fitted (dataset)
+#            on the training rows, and the encoded
+#            training matrix
+#   ridge    the Ridge fitted for one target      (dataset, target column)
+#   kmeans   the scaled KMeans fitted for one k,  (dataset, features, k)
+#            and its silhouette score
+# The entries are on disk (diskcache), so the background fitting jobs, each
+# in its own process, and the server workers all share them, and they
+# survive restarts. Nothing is invalidated explicitly: a changed dataset has
+# a different digest, and entries nobody asks for any more age out of the
+# size limit. stats() counts hits and fits per stage, across processes.
+# Entries are unpickled, so the cache belongs in a private_dir().
+DISK_BYTES = 1024 * 1024 * 1024
+
+
+# Directory `name` under $XDG_CACHE_HOME (default ~/.cache) that only this
+# user can read or write, created if need be
+def private_dir(name):
+    path = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), name)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700)
+    return path
+
+
+# Digest of the contents of source files, so what they compute is redone
+# after the code changes
+def code_version(*paths):
+    h = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+# Digest of a frame's contents: column names and dtypes, and every row
+def digest(df):
+    h = hashlib.sha1(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class FitCache:
+    def __init__(self, directory, disk_bytes=DISK_BYTES):
+        self.disk = diskcache.Cache(directory, size_limit=disk_bytes)
+
+    # Stored value of `stage` for `key`, computed with fit() and stored on a
+    # miss. Two processes missing the same entry at once both fit it; the
+    # results are the same.
+    def get(self, stage, key, fit):
+        address = f"{stage}:{hashlib.sha1(repr(key).encode()).hexdigest()}"
+        blob = self.disk.get(address)
+        if blob is not None:
+            self.disk.incr(f"hits:{stage}")
+            return pickle.loads(blob)
+        value = fit()
+        self.disk.set(address, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        self.disk.incr(f"fits:{stage}")
+        return value
+
+    def stats(self):
+        stages = ['frame', 'design', 'ridge', 'kmeans']
+        return {stage: {'hits': self.disk.get(f"hits:{stage}", 0), 'fits': self.disk.get(f"fits:{stage}", 0)}
+                for stage in stages}
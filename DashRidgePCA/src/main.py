@@ -1,12 +1,14 @@
 import warnings
 import base64
 import io
+import os
+import time
 from datetime import date
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import dash
-from dash import dcc, html, Input, Output, State, dash_table
+from dash import dcc, html, Input, Output, State, dash_table, DiskcacheManager
 import dash_bootstrap_components as dbc
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import make_pipeline
@@ -17,25 +19,76 @@ from sklearn.metrics import silhouette_score
 from sklearn.linear_model import Ridge
 from category_encoders import OneHotEncoder
 from sklearn.impute import SimpleImputer
+import diskcache
 import wrangle
-
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+import lazydata
+import fitcache
+import callbackcache
+
+# Job results and fitted models are pickled, so they are kept in a directory
+# only this user can write to ($XDG_CACHE_HOME/DashRidgePCA)
+Cache_path = fitcache.private_dir('DashRidgePCA')
+# The model fits run as background jobs: each in its own process, with
+# progress and results passed back through a disk cache that every server
+# worker can read (so polls may land on any of them)
+Jobs_path = os.path.join(Cache_path, 'jobs')
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
+                background_callback_manager=DiskcacheManager(diskcache.Cache(Jobs_path)))
+server = app.server
 
 # Wrangle function from wrangle module
 file_path = "/home/blueaz/Downloads/SensorDownload/May2024/ztennis.db" 
-df = wrangle.wrangle(file_path)
+# Session store (sessionstore.py) to read the Zepp rows from instead of the
+# database; it must have been ingested from this same database. None reads
+# the database
+Store_path = None
+
+
+# Size and mtime of the database, and of the store's marks when one is used
+def data_version():
+    if Store_path:
+        return callbackcache.file_version(file_path, os.path.join(Store_path, 'marks.json'))
+    return callbackcache.file_version(file_path)
+
+
+# The code that builds the wrangled frame, which versions it along with the data
+src_dir = os.path.dirname(os.path.abspath(__file__))
+wrangle_version = fitcache.code_version(
+    *[os.path.join(src_dir, name) for name in ['wrangle.py', 'sqlquery.py', 'sessionstore.py', 'timestamps.py']])
+
+
+# Wrangled frame and fitted models, reused across callbacks, jobs and
+# restarts until the data changes (see fitcache)
+Fits_path = os.path.join(Cache_path, 'fits')
+fits = fitcache.FitCache(Fits_path)
+
+
+# The wrangled frame and its digest, which keys the fits made from it; it is
+# computed once per load rather than on every callback
+def load_data():
+    df = fits.get('frame', (data_version(), wrangle_version),
+                  lambda: wrangle.wrangle(file_path, store=Store_path))
+    return df, fitcache.digest(df)
+
+
+# Loaded in the background from import (so in every gunicorn worker too);
+# the layout is served straight away. A job forked before the load is done
+# loads the frame itself, from the fits cache once any process has stored it
+data = lazydata.LazyData(load_data).start()
+
 
 # Layout
 app.layout = dbc.Container([
     dbc.Row([
         dbc.Col(html.H1("Interactive Dashboard")),
-        dbc.Col(dcc.Upload(id="upload-data", children=html.Button('Upload File')))
+        dbc.Col(dcc.Upload(id="upload-data", children=html.Button('Upload File'))),
+        dcc.Location(id='url'),
     ]),
     dbc.Row([
         dbc.Col([
             dcc.Dropdown(
                 id='target-column',
-                options=[{'label': col, 'value': col} for col in df.columns],
+                options=[],  # filled in once the data is loaded
                 value='swing_side',
                 clearable=False,
                 style={'width': '100%'}
@@ -44,12 +97,14 @@ app.layout = dbc.Container([
         dbc.Col(dcc.Slider(id="n_clusters", min=2, max=12, step=1, value=3,
                            marks={i: str(i) for i in range(2, 13)},)),
     ]),
+    # Shown while a fit runs; the graphs fill in as its stages finish
+    dbc.Progress(id="fit-progress", value=0, max=1, style={'visibility': 'hidden'}),
     dbc.Row([
         dbc.Col(dcc.Graph(id="bar-importance")),
         dbc.Col(dcc.Graph(id="kmeans-line")),
     ]),
     dbc.Row([
-        dbc.Col(dcc.Graph(id="pca-scatter")),
+        dbc.Col(dcc.Loading(dcc.Graph(id="pca-scatter"))),
     ]),
     dbc.Row([
         dbc.Col(html.H1("Summary Statistics")),
@@ -58,6 +113,13 @@ app.layout = dbc.Container([
 ])
 
 # Callbacks
+@app.callback(
+    Output('target-column', 'options'),
+    [Input('url', 'pathname')]
+)
+def populate_targets(pathname):
+    return [{'label': col, 'value': col} for col in data.get()[0].columns]
+
 @app.callback(
     [Output('bar-importance', 'figure'),
      Output('kmeans-line', 'figure'),
@@ -65,15 +127,29 @@ app.layout = dbc.Container([
      Output('summary-table', 'data')],
     [Input('upload-data', 'contents'),
      Input('target-column', 'value'),
-     Input('n_clusters', 'value')]
+     Input('n_clusters', 'value')],
+    # Runs as a background job so the server stays responsive. A job still
+    # running when the inputs change again is killed and replaced by the
+    # new one. Each stage's figure is sent as progress as soon as it is
+    # ready: feature importance, then the cluster sweep (growing by one k at
+    # a time), then the PCA scatter and summary with the final result.
+    background=True,
+    progress=[Output('fit-progress', 'value'),
+              Output('fit-progress', 'max'),
+              Output('bar-importance', 'figure'),
+              Output('kmeans-line', 'figure')],
+    running=[(Output('fit-progress', 'style'), {'visibility': 'visible'}, {'visibility': 'hidden'})],
+    interval=500,
 )
-def update_graph(contents, target_col, n_clusters):
+def update_graph(set_progress, contents, target_col, n_clusters):
     if contents is not None:
         content_type, content_string = contents.split(',')
         decoded = base64.b64decode(content_string)
         df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+        dataset = fitcache.digest(df)
     else:
-        df = wrangle.wrangle(file_path)
+        # Waits for the load here, in the job, if it is still running
+        df, dataset = data.get()
 
     # Split data
     sensor_cols = df.select_dtypes(include='number').columns
@@ -82,16 +158,17 @@ def update_graph(contents, target_col, n_clusters):
 
     X_train, X_test, y_train, y_test = train_test_split(X_data, y_data, test_size=0.2, random_state=42)
 
-    model = make_pipeline(
-        OneHotEncoder(use_cat_names=True),
-        SimpleImputer(),
-        Ridge()
-    )
+    # The split and the encoding don't depend on the target, so every
+    # target's Ridge is fitted on the same encoded matrix
+    def fit_design():
+        design = make_pipeline(OneHotEncoder(use_cat_names=True), SimpleImputer())
+        return design, design.fit_transform(X_train)
+    design, X_encoded = fits.get('design', dataset, fit_design)
 
     # Fit model and calculate feature importance
-    model.fit(X_train, y_train)
-    coefficients = model.named_steps["ridge"].coef_
-    features = model.named_steps["onehotencoder"].get_feature_names()
+    ridge = fits.get('ridge', (dataset, target_col), lambda: Ridge().fit(X_encoded, y_train))
+    coefficients = ridge.coef_
+    features = design.named_steps["onehotencoder"].get_feature_names()
     feat_imp = pd.Series(coefficients, index=features)
     top5 = feat_imp.sort_values(key=abs).tail(5).index.to_list()
 
@@ -100,28 +177,40 @@ def update_graph(contents, target_col, n_clusters):
                      x=feat_imp.sort_values(key=abs).tail(15),
                      labels={'x': 'Importance', 'y': 'Feature'},
                      title="Top 15 Important Features")
+    steps = n_clusters + 1
+    set_progress((1, steps, bar_fig, go.Figure()))
 
     # KMeans clustering
     X = df[top5]
     inertia_errors = []
     silhouette_scores = []
 
-    for k in range(2, n_clusters + 1):
+    # Fitted once per k for these features; raising n_clusters fits only
+    # the new k
+    def fit_kmeans(k):
         kmeans_model = make_pipeline(StandardScaler(), KMeans(n_clusters=k, random_state=42))
         kmeans_model.fit(X)
-        inertia_errors.append(kmeans_model.named_steps["kmeans"].inertia_)
-        silhouette_scores.append(
-            silhouette_score(X, kmeans_model.named_steps["kmeans"].labels_)
-        )
+        return kmeans_model, silhouette_score(X, kmeans_model.named_steps["kmeans"].labels_)
 
     # Plot Inertia and Silhouette Scores
-    kmeans_fig = px.line(x=list(range(2, n_clusters + 1)),
-                         y=inertia_errors, title="KMeans Inertia",
-                         labels={'x': 'Clusters', 'y': 'Inertia'})
+    def kmeans_line():
+        return px.line(x=list(range(2, len(inertia_errors) + 2)),
+                       y=inertia_errors, title="KMeans Inertia",
+                       labels={'x': 'Clusters', 'y': 'Inertia'})
 
-    # PCA Scatterplot
-    pca_model = make_pipeline(StandardScaler(), KMeans(n_clusters=2, random_state=42))
-    pca_model.fit(X)
+    for k in range(2, n_clusters + 1):
+        began = time.perf_counter()
+        kmeans_model, score = fits.get('kmeans', (dataset, tuple(top5), k), lambda: fit_kmeans(k))
+        inertia_errors.append(kmeans_model.named_steps["kmeans"].inertia_)
+        silhouette_scores.append(score)
+        # Show the curve so far after each fit, but not after each k that
+        # came straight from the cache
+        if time.perf_counter() - began > 0.05:
+            set_progress((k, steps, bar_fig, kmeans_line()))
+    kmeans_fig = kmeans_line()
+
+    # PCA Scatterplot, coloured by the k=2 clusters of the sweep
+    pca_model, _ = fits.get('kmeans', (dataset, tuple(top5), 2), lambda: fit_kmeans(2))
     labels = pca_model.named_steps["kmeans"].labels_
 
     pca = PCA(n_components=2)
@@ -136,6 +225,11 @@ def update_graph(contents, target_col, n_clusters):
     return bar_fig, kmeans_fig, pca_fig, summary_stats
 
 
+@app.server.route('/fit-stats')
+def fit_stats():
+    return fits.stats()
+
+
 if __name__ == "__main__":
     app.run_server(debug=True)
 
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+# America/Phoenix does not observe daylight saving time, so local time is
+# always UTC-7 and the conversion is a single integer subtraction.
+PHOENIX_OFFSET_NS = -7 * 3600 * 1_000_000_000
+
+# Nanoseconds per tick of each sensor's raw epoch column
+UNIT_NS = {
+    'ns': 1,                  # Apple Watch WristMotion.csv `time`
+    'ms': 1_000_000,          # Zepp `l_id` / `client_created`
+    '100us': 100_000,         # Babolat `time` (seconds * 10000)
+    's': 1_000_000_000,
+}
+
+# Epoch ticks -> naive datetime64[ns] in Phoenix wall-clock time
+def epoch_to_local(values, unit='ns'):
+    ns = np.asarray(values, dtype='int64') * UNIT_NS[unit] + PHOENIX_OFFSET_NS
+    return ns.view('datetime64[ns]')
+
+
+# Phoenix wall-clock date/datetime (anything pd.Timestamp accepts) -> epoch ticks,
+# used to push date bounds down to the raw epoch columns
+def local_to_epoch(value, unit='ns'):
+    ns = pd.Timestamp(value).tz_localize(None).value - PHOENIX_OFFSET_NS
+    return ns // UNIT_NS[unit]
@@ -1,28 +1,40 @@
 import sqlite3
 import pandas as pd
-import pytz
+import timestamps
+import sqlquery
+
+# Columns the derived fields below are built from
+REQUIRED_COLUMNS = ['l_id', 'swing_type', 'swing_side',
+                    'impact_position_x', 'impact_position_y']
 
 # Build your `wrangle` function here
-def wrangle(db_path):
+def wrangle(db_path, start_date=None, end_date=None, columns=None, store=None):
+    # Always select the columns the derived fields are built from
+    if columns is not None:
+        columns = REQUIRED_COLUMNS + [c for c in columns if c not in REQUIRED_COLUMNS]
+
+    # Serve from the columnar session store when it holds the Zepp sensor
+    if store:
+        import sessionstore
+        df = sessionstore.read_sensor(store, 'zepp', start_date, end_date,
+                                      None if columns is None else ['time'] + columns)
+        if df is not None:
+            return from_store(df, columns)
+
     # Connect to database
     conn = sqlite3.connect(db_path)
 
-    # Construct query
-    query = """
-    SELECT * 
-    FROM swings
-    """
+    # Push the date window and projection down into SQLite (l_id is epoch ms)
+    start_ms = timestamps.local_to_epoch(start_date, 'ms') if start_date else None
+    end_ms = timestamps.local_to_epoch(end_date, 'ms') if end_date else None
     # Read query results into DataFrame
     # df = pd.read_sql(query, conn, index_col="time")
-    df = pd.read_sql(query, conn)
+    df = sqlquery.read_range(conn, 'swings', 'l_id', start_ms, end_ms, columns)
     df = df.sort_index()  
     # df = df.drop_duplicates()
     
-    df['l_id'] = pd.to_datetime(df['l_id'], unit='ms')
-    az_timezone = pytz.timezone('America/Phoenix')
-    df['l_id'] = df['l_id'].dt.tz_localize('UTC').dt.tz_convert(az_timezone)
-    df['l_id'] = df['l_id'].dt.strftime('%m-%d-%Y %I:%M:%S %p')
-    df["l_id"] = pd.to_datetime(df["l_id"])
+    # Epoch ms -> Phoenix local datetime64 in one step
+    df['l_id'] = timestamps.epoch_to_local(df['l_id'], 'ms')
 
     df.dropna(inplace=True)
     df = df.sort_values("l_id")
@@ -42,3 +54,19 @@ def wrangle(db_path):
     conn.close()
     
     return df
+
+# Store rows (wrangled by UZeppWrangle, with the same mappings and derived
+# columns) -> the columns and dtypes the database path gives: l_id back in
+# front, the extra timestamp dropped, categoricals plain and float32
+# channels widened
+def from_store(df, columns):
+    df.insert(0, 'l_id', df.pop('time'))
+    derived = ['hand_type', 'stroke', 'diffxy']
+    df = df[(columns if columns is not None else
+             [c for c in df.columns if c not in derived + ['timestamp']]) + derived].copy()
+    for c in df.columns:
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype(object)
+        elif df[c].dtype == 'float32':
+            df[c] = df[c].astype('float64')
+    return df
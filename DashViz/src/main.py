@@ -4,11 +4,11 @@ import io
 from datetime import date
 import sqlite3
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import numpy as np
 from dash import Dash, Input, Output, dcc, html, callback, dash_table
 import plotly.express as px
+import lazydata
+import timeindex
 import plotly.graph_objects as go
 
 # Build your `wrangle` function here
@@ -18,7 +18,7 @@ def wrangle(db_path):
 
     # Construct query
     query = """
-    SELECT _id, date, TYPE, TRACKID, ENDTIME, CAL, AVGHR, MAX_HR from TRACKRECORD
+    SELECT _id, DATE, TYPE, TRACKID, ENDTIME, CAL, AVGHR, MAX_HR from TRACKRECORD
     """
 
     # Read query results into DataFrame
@@ -41,13 +41,16 @@ def wrangle(db_path):
     new_type = {16: "Free", 10: "IndCyc", 9: "OutCyc", 12: "Elliptical", 60: "Yoga", 14: "Swim" }
     df['TYPE'] = df['TYPE'].replace(new_type)
 
-    return df
+    # Parse DATE once and keep the frame sorted by it for the date filter
+    df['DATE'] = pd.to_datetime(df['DATE'])
+    return timeindex.sort_by_time(df, 'DATE')
 
 # PC path
 file_path = "/home/blueaz/Downloads/SensorDownload/Sep14/MiiFit.db"
 warnings.simplefilter("ignore", UserWarning)
 
-df = wrangle(file_path)
+# Loaded in the background so the layout is served straight away
+data = lazydata.LazyData(lambda: wrangle(file_path))
 
 app = Dash(__name__)
 
@@ -71,7 +74,7 @@ app.layout = html.Div([
         id="hue-button"
     ),
     html.H1("Pairs plot"),
-    dcc.Graph(id="pairs-plot", style={'width': '80vh', 'height': '80vh'}),
+    dcc.Loading(dcc.Graph(id="pairs-plot", style={'width': '80vh', 'height': '80vh'})),
     html.H1("New element"),
 ])
 
@@ -111,13 +114,17 @@ def update_date_text_output(start_date, end_date):
 )
 def serve_scatter(start_date, end_date, hue):
     if isinstance(hue, bool):
+        df = data.get()
         if start_date is not None and end_date is not None:
             start_date_object = date.fromisoformat(start_date)
             end_date_object = date.fromisoformat(end_date)
-            df_subset = sub_date(start_date_object, end_date_object)
+            df_subset = sub_date(df, start_date_object, end_date_object)
         else:
             df_subset = df  # Use the entire DataFrame when no date range is selected
 
+        # seaborn (and matplotlib behind it) load on the first plot
+        import seaborn as sns
+
         # Create a Seaborn PairGrid
         pair_grid = sns.pairplot(df_subset, hue="TYPE" if hue else None)
         
@@ -146,12 +153,10 @@ def serve_scatter(start_date, end_date, hue):
             }
         }
 
-def sub_date(start_date, end_date):
-    # Convert the 'DATE' column to datetime.date
-    df['DATE'] = pd.to_datetime(df['DATE']).dt.date
-    # Subset dates
-    df_subset = df[df['DATE'].between(start_date, end_date)]
-    return df_subset
+def sub_date(df, start_date, end_date):
+    # Subset whole dates by binary search on the sorted DATE column
+    return timeindex.between_dates(df, 'DATE', start_date, end_date)
 
 if __name__ == '__main__':
+    data.start()
     app.run(debug=True)
@@ -0,0 +1,53 @@
+// Histogram re-binning in the browser. The server sends the fine bins of the
+// current selection once (figures.histogram_data: base64 Int32Arrays of bin
+// positions and per-trace counts); the bin slider then only runs rebin(),
+// which merges adjacent fine bins into at most `nbins` equal bins spanning
+// the occupied ones, the same way for every slider value, with no request
+// to the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    histogram: {
+        rebin: function(data, nbins) {
+            if (!data) {
+                return window.dash_clientside.no_update;
+            }
+            const decode = function(text) {
+                const bytes = Uint8Array.from(atob(text), function(c) { return c.charCodeAt(0); });
+                return new Int32Array(bytes.buffer);
+            };
+            const position = decode(data.position);
+            const counts = data.names.map(function(name) { return decode(data.counts[name]); });
+
+            // Fine bins with any count, across all traces
+            const occupied = [];
+            for (let i = 0; i < position.length; i++) {
+                if (counts.some(function(c) { return c[i] > 0; })) {
+                    occupied.push(i);
+                }
+            }
+            const layout = Object.assign({}, data.layout, {
+                title: {text: data.title.replace('{bins}', nbins)}
+            });
+            if (!occupied.length) {
+                return {data: [], layout: layout};
+            }
+
+            const lo = position[occupied[0]];
+            const hi = position[occupied[occupied.length - 1]] + 1;
+            const group = Math.ceil((hi - lo) / Math.max(nbins, 1));
+            const n = Math.ceil((hi - lo) / group);
+            const width = data.width * group;
+            const x = [];
+            for (let k = 0; k < n; k++) {
+                x.push(data.start + data.width * lo + width * (k + 0.5));
+            }
+            const traces = data.names.map(function(name, t) {
+                const y = new Array(n).fill(0);
+                for (const i of occupied) {
+                    y[Math.floor((position[i] - lo) / group)] += counts[t][i];
+                }
+                return {type: 'bar', name: name, x: x, y: y, width: width};
+            });
+            return {data: traces, layout: layout};
+        }
+    }
+});
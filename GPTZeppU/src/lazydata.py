@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+# Loads a dashboard's data once, in a background thread, so the server can
+# bind and serve the layout immediately. Callbacks call get(), which waits
+# for the load to finish (the dcc.Loading spinners show meanwhile) and
+# re-raises anything the loader raised.
+#
+# `version`, if given, is called just before loading and its value kept as
+# the loaded data's version (e.g. the source files' sizes and mtimes), so
+# results cached across restarts can be keyed on it; otherwise the version
+# is the load's start time and only identifies it within this process.
+#
+# A process forked while the load is running (e.g. a background callback's
+# job) gets no loading thread; it starts a load of its own when it needs the
+# data. One forked after the load keeps the loaded value.
+class LazyData:
+    def __init__(self, loader, version=None):
+        self.loader = loader
+        self.version_fn = version
+        self.version = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.thread = None
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        os.register_at_fork(after_in_child=self._forked)
+
+    # Start loading if nobody has yet; safe to call from any thread
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._load, daemon=True)
+                self.thread.start()
+        return self
+
+    def _forked(self):
+        if not self.done.is_set():
+            self.lock = threading.Lock()
+            self.done = threading.Event()
+            self.thread = None
+
+    def _load(self):
+        began = time.perf_counter()
+        try:
+            self.version = self.version_fn() if self.version_fn else str(time.time_ns())
+            self.value = self.loader()
+        except Exception as exc:
+            self.error = exc
+        self.load_seconds = time.perf_counter() - began
+        self.done.set()
+
+    def ready(self):
+        return self.done.is_set()
+
+    def get(self):
+        self.start()
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    # Version of the loaded data, waiting for the load like get()
+    def get_version(self):
+        self.get()
+        return self.version
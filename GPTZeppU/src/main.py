@@ -1,3 +1,4 @@
+import os
 import warnings
 import sqlite3
 from datetime import date
@@ -5,39 +6,80 @@ import pandas as pd
 import plotly.express as px
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ClientsideFunction
 import wrangle
+import lazydata
+import figures
+import callbackcache
+import timeindex
+import aggcube
+import sharedframes
 
 # Suppress warnings
 warnings.simplefilter("ignore", UserWarning)
 
 # Input data path
 file_path = "/home/blueaz/Downloads/SensorDownload/May2024/ztennis.db" 
+# Session store (sessionstore.py) to read the Zepp rows from instead of
+# the database; it must have been ingested from this same database. None reads
+# the database
+Store_path = None
 
-# Wrangle the data
-df = wrangle.wrangle(file_path)
 
-# Convert client_created to datetime if it's not already
-df['client_created'] = pd.to_datetime(df['client_created'], unit='ms')  # Adjust 'unit' accordingly
+# Size and mtime of the database, and of the store's marks when one is used
+def data_version():
+    if Store_path:
+        return callbackcache.file_version(file_path, os.path.join(Store_path, 'marks.json'))
+    return callbackcache.file_version(file_path)
+
+# Wrangle the data
+def load_data():
+    df = wrangle.wrangle(file_path, store=Store_path)
+
+    # Convert client_created to datetime if it's not already
+    df['client_created'] = pd.to_datetime(df['client_created'], unit='ms')  # Adjust 'unit' accordingly
+    # Kept sorted by time for the date filter
+    return timeindex.sort_by_time(df, 'client_created')
+
+# Set to a directory to keep cached callback results across restarts
+Cache_path = None
+# The loaded data is published here once and memory-mapped by every
+# gunicorn worker (see sharedframes.py); None, as when run directly, loads
+# it in each process instead
+Shared_path = "/dev/shm/GPTZeppU" if sharedframes.under_gunicorn() else None
+# The dashboard's code, which versions the shared data along with the
+# sources, so editing the wrangling or merging republishes it
+code_version = sharedframes.code_version(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded in the background so the layout is served straight away, or
+# attached from the shared copy; the source version keys both and the
+# callback cache
+data = lazydata.LazyData(
+    lambda: sharedframes.load(Shared_path, f'{data_version()}|{code_version}', load_data),
+    version=data_version)
+
+# Day x swing type aggregates of the calc fields, built once the data is
+# loaded; the histogram and stats table are answered from these
+cube = lazydata.LazyData(lambda: aggcube.Cube(data.get(), 'client_created', 'swing_type', calc),
+                         version=data.get_version)
+
+# Results of update_output per (data version, inputs); hit rate at /cache-stats
+cache = callbackcache.CallbackCache(directory=Cache_path)
 
 # Session and calc fields
 calc = ['backswing_time', 'power', 'ball_spin', 'impact_position_x', 'impact_position_y', 'racket_speed', 'impact_region']
 
-# App setup
+# App setup; `server` is the WSGI app for gunicorn (main:server)
 app = dash.Dash(__name__)
+server = app.server
 
 # Layout
 app.layout = html.Div([
     html.H1("Tennis Sensor Data Dashboard"),
+    dcc.Location(id='url'),
 
-    # Date picker for selecting range
-    dcc.DatePickerRange(
-        id='date-picker',
-        min_date_allowed=df['client_created'].min().date(),
-        max_date_allowed=df['client_created'].max().date(),
-        start_date=df['client_created'].min().date(),
-        end_date=df['client_created'].max().date(),
-    ),
+    # Date picker for selecting range (bounds filled in once the data is loaded)
+    dcc.DatePickerRange(id='date-picker'),
 
     # Dropdown for y-axis selection
     html.Label("Y-axis metric"),
@@ -52,13 +94,13 @@ app.layout = html.Div([
     html.Label("Swing Type"),
     dcc.Checklist(
         id='swing-type-checklist',
-        options=[{'label': s, 'value': s} for s in df['swing_type'].unique()],
-        value=df['swing_type'].unique(),  # Default to all selected
+        options=[],
+        value=[],
         inline=True
     ),
 
     # Scatter plot
-    dcc.Graph(id='scatter-plot'),
+    dcc.Loading(dcc.Graph(id='scatter-plot')),
 
     # Histogram bin slider
     html.Label("Number of Bins for Histogram"),
@@ -71,54 +113,76 @@ app.layout = html.Div([
         marks={i: str(i) for i in range(5, 101, 10)}
     ),
 
-    # Histogram plot
-    dcc.Graph(id='histogram-plot'),
+    # Histogram plot, re-binned in the browser from the fine bins in the store
+    dcc.Store(id='histogram-data'),
+    dcc.Loading(dcc.Graph(id='histogram-plot')),
 
     # Summary stats table
-    html.Div(id='summary-stats', style={'margin-top': '20px'})
+    dcc.Loading(html.Div(id='summary-stats', style={'margin-top': '20px'}))
 ])
 
+# Fill in the data-dependent controls on page load; the plots wait for these
+@app.callback(
+    [Output('date-picker', 'min_date_allowed'),
+     Output('date-picker', 'max_date_allowed'),
+     Output('date-picker', 'start_date'),
+     Output('date-picker', 'end_date'),
+     Output('swing-type-checklist', 'options'),
+     Output('swing-type-checklist', 'value')],
+    [Input('url', 'pathname')]
+)
+def populate_controls(pathname):
+    df = data.get()
+    first, last = df['client_created'].min().date(), df['client_created'].max().date()
+    # In the order they first appear by l_id, as wrangled: the frame is in
+    # client_created order
+    swing_types = df.sort_values('l_id', kind='stable')['swing_type'].unique().tolist()
+    return first, last, first, last, [{'label': s, 'value': s} for s in swing_types], swing_types  # Default to all selected
+
 # Callback for updating scatter plot, histogram, and stats
 @app.callback(
     [Output('scatter-plot', 'figure'),
-     Output('histogram-plot', 'figure'),
+     Output('histogram-data', 'data'),
      Output('summary-stats', 'children')],
     [Input('date-picker', 'start_date'),
      Input('date-picker', 'end_date'),
      Input('y-axis-dropdown', 'value'),
-     Input('swing-type-checklist', 'value'),
-     Input('bin-slider', 'value')]
+     Input('swing-type-checklist', 'value')]
 )
-def update_output(start_date, end_date, y_axis, selected_swing_types, num_bins):
-    # Convert start_date and end_date to datetime format
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
+@cache.memoize(data.get_version, unordered=('selected_swing_types',))
+def update_output(start_date, end_date, y_axis, selected_swing_types):
+    df = data.get()
 
-    # Filter by date range and swing types
-    filtered_df = df[(df['client_created'] >= start_date) & (df['client_created'] <= end_date)]
+    # Slice the date range out of the time-sorted frame, then filter by swing
+    # type within the slice only
+    filtered_df = timeindex.between(df, 'client_created', start_date, end_date)
     filtered_df = filtered_df[filtered_df['swing_type'].isin(selected_swing_types)]
 
     # Scatter plot
     scatter_fig = px.scatter(
         filtered_df,
+        render_mode=figures.render_mode(len(filtered_df)),  # WebGL for large selections
         x="l_id",
         y=y_axis,
         color="swing_type",
         title=f"Scatter plot of l_id vs {y_axis}"
     )
 
-    # Histogram plot with adjustable number of bins and color by swing_type
-    histogram_fig = px.histogram(
-        filtered_df,
-        x=y_axis,
-        nbins=num_bins,
-        color="swing_type",  # Add this to color by swing_type
-        title=f"Histogram of {y_axis} with {num_bins} bins"
+    # Histogram and summary stats from the cube, without going through the
+    # selected rows
+    selection = cube.get().select(start_date, end_date, selected_swing_types)
+
+    # Histogram fine bins by swing_type; the bin slider re-bins them client-side
+    start, width, position, counts = selection.fine_bins(y_axis)
+    histogram_data = figures.histogram_data(
+        start, width, position, counts,
+        title=f"Histogram of {y_axis} with {{bins}} bins",
+        xaxis_title=y_axis,
+        legend_title_text="swing_type"  # Add this to color by swing_type
     )
-    
 
     # Summary stats
-    summary_stats = filtered_df[y_axis].describe().to_frame().reset_index()
+    summary_stats = selection.describe(y_axis).to_frame().reset_index()
     summary_table = html.Table([
         html.Thead(html.Tr([html.Th(col) for col in summary_stats.columns])),
         html.Tbody([
@@ -127,9 +191,23 @@ def update_output(start_date, end_date, y_axis, selected_swing_types, num_bins):
         ])
     ])
 
-    return scatter_fig, histogram_fig, summary_table
+    return scatter_fig, histogram_data, summary_table
+
+# Histogram with adjustable number of bins, built in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='histogram', function_name='rebin'),
+    Output('histogram-plot', 'figure'),
+    [Input('histogram-data', 'data'),
+     Input('bin-slider', 'value')]
+)
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return cache.stats()
 
 # Run the app
 if __name__ == '__main__':
+    data.start()
+    cube.start()
     app.run_server(debug=True)
 
@@ -0,0 +1,192 @@
+import argparse
+import importlib
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import timestamps
+import watermarks
+
+# Columnar session store: one Parquet file per sensor and Phoenix-local day,
+#   <store>/sensor=<name>/day=<YYYY-MM-DD>/part-0.parquet
+# Timestamps are stored as a single int64 `epoch_ns` (UTC) column and the
+# wrangled datetime (and raw epoch) columns are rebuilt from it on read.
+
+EPOCH_COL = 'epoch_ns'
+MARKS_FILE = 'marks.json'
+DAY_NS = 86400 * 1_000_000_000
+
+SENSORS = {
+    'zepp': {
+        'datetime_cols': ['time', 'timestamp'],
+        'epoch_cols': [],
+        'categorical': ['swing_type', 'hand_type', 'stroke'],
+        'float32_prefix': ('dbg_',),
+        'always': ['swing_type', 'hand_type', 'stroke', 'diffxy'],
+    },
+    'bab': {
+        'datetime_cols': ['time'],
+        'epoch_cols': [],
+        'categorical': ['type', 'spin'],
+        'float32_prefix': (),
+        'always': ['PIQ'],
+    },
+    'watch': {
+        'datetime_cols': ['timestamp'],
+        'epoch_cols': ['time'],
+        'categorical': [],
+        'float32_prefix': ('rotationRate', 'gravity', 'acceleration', 'quaternion'),
+        'always': [],
+    },
+}
+
+
+def sensor_dir(store, sensor):
+    return os.path.join(store, f'sensor={sensor}')
+
+
+# Days present in the store for a sensor, as sorted 'YYYY-MM-DD' strings
+def list_days(store, sensor):
+    root = sensor_dir(store, sensor)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name[4:] for name in os.listdir(root) if name.startswith('day='))
+
+
+# Wrangled frame -> typed Arrow-friendly frame with an int64 epoch column
+def to_store_frame(df, sensor):
+    spec = SENSORS[sensor]
+    out = df.copy()
+    local_ns = out[spec['datetime_cols'][0]].to_numpy('datetime64[ns]').view('int64')
+    out[EPOCH_COL] = local_ns - timestamps.PHOENIX_OFFSET_NS
+    dropped = spec['datetime_cols'] + spec['epoch_cols']
+    out = out.drop(columns=[c for c in dropped if c in out.columns])
+    for col in spec['categorical']:
+        if col in out.columns:
+            out[col] = out[col].astype('category')
+    for col in out.columns:
+        if col.startswith(spec['float32_prefix']) and out[col].dtype == 'float64':
+            out[col] = out[col].astype('float32')
+    return out.reset_index(drop=True)
+
+
+# Write one file per local day into that day's partition, replacing any
+# existing file with the same part name
+def write_sensor(store, sensor, df, part='part-0'):
+    if len(df) == 0:
+        return []
+    out = to_store_frame(df, sensor)
+    local_day = (out[EPOCH_COL].to_numpy() + timestamps.PHOENIX_OFFSET_NS) // DAY_NS
+    written = []
+    for day in np.unique(local_day):
+        day_str = str(np.datetime64(int(day), 'D'))
+        path = os.path.join(sensor_dir(store, sensor), f'day={day_str}')
+        os.makedirs(path, exist_ok=True)
+        table = pa.Table.from_pandas(out[local_day == day], preserve_index=False)
+        pq.write_table(table, os.path.join(path, f'{part}.parquet'))
+        written.append(day_str)
+    return written
+
+
+# Read a sensor's rows between start_date and end_date (Phoenix local), touching
+# only the day partitions in range and only the requested columns. Returns None
+# when the store holds nothing for the sensor so callers can fall back to raw.
+def read_sensor(store, sensor, start_date=None, end_date=None, columns=None):
+    days = list_days(store, sensor)
+    if not days:
+        return None
+    start_day = str(pd.Timestamp(start_date).date()) if start_date else days[0]
+    end_day = str(pd.Timestamp(end_date).date()) if end_date else days[-1]
+    days = [d for d in days if start_day <= d <= end_day]
+
+    df = read_days(store, sensor, days, columns)
+    epoch = df.pop(EPOCH_COL).to_numpy()
+    mask = np.ones(len(df), dtype=bool)
+    if start_date:
+        mask &= epoch >= timestamps.local_to_epoch(start_date, 'ns')
+    if end_date:
+        mask &= epoch <= timestamps.local_to_epoch(end_date, 'ns')
+    return df[mask].sort_values(SENSORS[sensor]['datetime_cols'][0]).reset_index(drop=True)
+
+
+# All of one sensor's rows, one stored day at a time in time order, so a
+# caller that doesn't need them as one frame holds about a day of them
+def iter_sensor(store, sensor, columns=None):
+    for day in list_days(store, sensor):
+        df = read_days(store, sensor, [day], columns)
+        df.pop(EPOCH_COL)
+        yield df.sort_values(SENSORS[sensor]['datetime_cols'][0]).reset_index(drop=True)
+
+
+# The rows of the given day partitions as one unsorted frame, with EPOCH_COL
+def read_days(store, sensor, days, columns=None):
+    spec = SENSORS[sensor]
+    tables = []
+    for day in days:
+        path = os.path.join(sensor_dir(store, sensor), f'day={day}')
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.parquet'):
+                continue
+            file_path = os.path.join(path, name)
+            read_cols = None
+            if columns is not None:
+                schema = pq.read_schema(file_path).names
+                wanted = [EPOCH_COL] + spec['always'] + list(columns)
+                read_cols = [c for c in dict.fromkeys(wanted) if c in schema]
+            tables.append(pq.read_table(file_path, columns=read_cols, memory_map=True))
+    if tables:
+        table = pa.concat_tables(tables, promote_options='default')
+    else:
+        table = pa.table({EPOCH_COL: pa.array([], pa.int64())})
+    return to_frame(table, sensor)
+
+
+# Arrow table -> wrangled frame with the datetime columns restored
+def to_frame(table, sensor):
+    df = table.to_pandas()
+    local = timestamps.epoch_to_local(df[EPOCH_COL], 'ns')
+    for col in SENSORS[sensor]['datetime_cols']:
+        df[col] = local
+    for col in SENSORS[sensor]['epoch_cols']:
+        df[col] = df[EPOCH_COL]
+    return df
+
+
+# Bring the store up to date with the raw sources. Each source is read only
+# past its persisted high-water mark and the new rows are written as an extra
+# part file in each day they touch; `full` discards the store and starts over.
+def ingest(store, zepp_path=None, bab_path=None, watch_path=None, full=False):
+    loaders = {
+        'zepp': (zepp_path, 'UZeppWrangle', 'UZeppSince'),
+        'bab': (bab_path, 'BabWrangle', 'BabSince'),
+        'watch': (watch_path, 'WatchWrangle', 'WatchSince'),
+    }
+    marks_path = os.path.join(store, MARKS_FILE)
+    os.makedirs(store, exist_ok=True)
+    marks = watermarks.load(marks_path)
+    for sensor, (path, module, name) in loaders.items():
+        if not path:
+            continue
+        if full:
+            shutil.rmtree(sensor_dir(store, sensor), ignore_errors=True)
+            marks.pop(sensor, None)
+        mark = marks.get(sensor, 0)
+        since = getattr(importlib.import_module(module), name)
+        df, marks[sensor] = since(path, mark)
+        days = write_sensor(store, sensor, df, part=f'part-{mark}')
+        watermarks.save(marks_path, marks)
+        print(f"{sensor}: {len(df)} new rows -> {len(days)} day partitions")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the columnar session store")
+    parser.add_argument('command', choices=['ingest'])
+    parser.add_argument('--store', required=True)
+    parser.add_argument('--zepp', help="path to ztennis.db")
+    parser.add_argument('--bab', help="path to BabPopExt.db")
+    parser.add_argument('--watch', help="path to WristMotion.csv")
+    parser.add_argument('--full', action='store_true', help="rebuild instead of appending")
+    args = parser.parse_args()
+    ingest(args.store, args.zepp, args.bab, args.watch, args.full)
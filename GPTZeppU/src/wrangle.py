@@ -1,38 +1,65 @@
 import sqlite3
 import pandas as pd
-import pytz
+import timestamps
+import sqlquery
+
+# Columns the derived fields below are built from
+REQUIRED_COLUMNS = ['l_id', 'swing_type', 'swing_side']
+HAND_TYPE = {2: "BH", 1: "FH"}
 
 # Build your `wrangle` function here
-def wrangle(db_path):
+def wrangle(db_path, start_date=None, end_date=None, columns=None, store=None):
+    # Always select the columns the derived fields are built from
+    if columns is not None:
+        columns = REQUIRED_COLUMNS + [c for c in columns if c not in REQUIRED_COLUMNS]
+
+    # Serve from the columnar session store when it holds the Zepp sensor
+    if store:
+        import sessionstore
+        df = sessionstore.read_sensor(store, 'zepp', start_date, end_date,
+                                      None if columns is None else ['time'] + columns)
+        if df is not None:
+            return from_store(df, columns)
+
     # Connect to database
     conn = sqlite3.connect(db_path)
 
-    # Construct query
-    query = """
-    SELECT * 
-    FROM swings
-    """
+    # Push the date window and projection down into SQLite (l_id is epoch ms)
+    start_ms = timestamps.local_to_epoch(start_date, 'ms') if start_date else None
+    end_ms = timestamps.local_to_epoch(end_date, 'ms') if end_date else None
     # Read query results into DataFrame
     # df = pd.read_sql(query, conn, index_col="time")
-    df = pd.read_sql(query, conn)
+    df = sqlquery.read_range(conn, 'swings', 'l_id', start_ms, end_ms, columns)
     df = df.sort_index()  
     # df = df.drop_duplicates()
     
-    df['l_id'] = pd.to_datetime(df['l_id'], unit='ms')
-    az_timezone = pytz.timezone('America/Phoenix')
-    df['l_id'] = df['l_id'].dt.tz_localize('UTC').dt.tz_convert(az_timezone)
-    df['l_id'] = df['l_id'].dt.strftime('%m-%d-%Y %I:%M:%S %p')
-    df["l_id"] = pd.to_datetime(df["l_id"])
+    # Epoch ms -> Phoenix local datetime64 in one step
+    df['l_id'] = timestamps.epoch_to_local(df['l_id'], 'ms')
 
     df.dropna(inplace=True)
     df = df.sort_values("l_id")
     # df.set_index('l_id', inplace=True)
     # Replace # with descriptions
-    hand_type = {2: "BH", 1: "FH"}
     swing_type = {4: "VOLLEY", 3: "SERVE", 2: "TOPSPIN", 0: "SLICE", 1: "FLAT", 5: "SMASH"}
     df['swing_type'] = df['swing_type'].replace(swing_type)
-    df['hand_type'] = df['swing_side'].replace(hand_type)
+    df['hand_type'] = df['swing_side'].replace(HAND_TYPE)
 
     conn.close()
     
     return df
+
+# Store rows (wrangled by UZeppWrangle) -> the columns and dtypes the
+# database path gives: l_id back in front, UZeppWrangle's extra columns
+# dropped, hand_type re-derived with this dashboard's mapping, swing_type
+# uncategorised and float32 channels widened
+def from_store(df, columns):
+    df.insert(0, 'l_id', df.pop('time'))
+    df = df[columns if columns is not None else
+            [c for c in df.columns if c not in ('timestamp', 'stroke', 'diffxy', 'hand_type')]].copy()
+    for c in df.columns:
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype(object)
+        elif df[c].dtype == 'float32':
+            df[c] = df[c].astype('float64')
+    df['hand_type'] = df['swing_side'].replace(HAND_TYPE)
+    return df
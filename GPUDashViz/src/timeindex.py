@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+# Time-range selection on frames kept sorted by one datetime column. A frame
+# is sorted once when it is loaded (sort_by_time); after that a date filter is
+# two binary searches on the column's datetime64 values and a positional
+# slice, df.iloc[lo:hi], which shares the frame's data. Selecting a range
+# costs O(log n), and any further filter (type, stroke, ...) is applied to the
+# k rows of the slice only, instead of two full-column comparisons and a
+# boolean-mask copy of the whole frame per callback.
+
+
+# `df` sorted by `column` (stable, so rows with equal times keep their order);
+# returned as is when it already is
+def sort_by_time(df, column):
+    if df[column].is_monotonic_increasing:
+        return df
+    return df.sort_values(column, kind='stable')
+
+
+def _datetime64(value):
+    return np.datetime64(pd.Timestamp(value).tz_localize(None), 'ns')
+
+
+# Positions [lo, hi) of start <= t <= end in sorted datetime64 `values`
+# (anything pd.Timestamp accepts; None leaves that side open)
+def span(values, start=None, end=None):
+    lo = int(np.searchsorted(values, _datetime64(start), side='left')) if start is not None else 0
+    hi = int(np.searchsorted(values, _datetime64(end), side='right')) if end is not None else len(values)
+    return lo, max(lo, hi)
+
+
+# Rows of `df` (sorted by `column`) with start <= df[column] <= end, as a slice
+def between(df, column, start=None, end=None):
+    lo, hi = span(df[column].to_numpy(), start, end)
+    return df.iloc[lo:hi]
+
+
+# Same for whole days: from start_date's midnight to the end of end_date
+def between_dates(df, column, start_date=None, end_date=None):
+    values = df[column].to_numpy()
+    lo = span(values, start_date)[0]
+    hi = len(values)
+    if end_date is not None:
+        hi = max(lo, int(np.searchsorted(values, _datetime64(end_date) + np.timedelta64(1, 'D'), side='left')))
+    return df.iloc[lo:hi]
@@ -2,6 +2,8 @@ import warnings
 import sqlite3
 import pandas as pd
 import plotly.express as px
+import lazydata
+import timeindex
 from datetime import date
 from dash import Dash, Input, Output, dcc, html, dash_table
 
@@ -35,13 +37,18 @@ def wrangle(db_path):
     new_type = {16: "Free", 10: "IndCyc", 9: "OutCyc", 12: "Elliptical", 60: "Yoga", 14: "Swim" }
     df['TYPE'] = df['TYPE'].replace(new_type)
 
-    return df
+    # Parse DATE once, dropping rows where that fails, and keep the frame
+    # sorted by it for the date filter
+    df['DATE'] = pd.to_datetime(df['DATE'], errors='coerce')
+    df = df.dropna(subset=['DATE'])
+    return timeindex.sort_by_time(df, 'DATE')
 
 # PC path
 file_path = "/home/blueaz/Downloads/SensorDownload/Sep14/MiiFit.db"
 warnings.simplefilter("ignore", UserWarning)
 
-df = wrangle(file_path)
+# Loaded in the background so the layout is served straight away
+data = lazydata.LazyData(lambda: wrangle(file_path))
 
 app = Dash(__name__)
 
@@ -65,7 +72,7 @@ app.layout = html.Div([
         id="hue-button"
     ),
     html.H1("Pairs plot"),
-    dcc.Graph(id="pairs-plot", style={'width': '80vh', 'height': '80vh'}),
+    dcc.Loading(dcc.Graph(id="pairs-plot", style={'width': '80vh', 'height': '80vh'})),
 
     # New section for summary statistics
     html.H1("Summary Statistics"),
@@ -104,10 +111,11 @@ def update_date_text_output(start_date, end_date):
     prevent_initial_call=True
 )
 def serve_scatter(start_date, end_date, hue):
+    df = data.get()
     if start_date is not None and end_date is not None:
         start_date_object = date.fromisoformat(start_date)
         end_date_object = date.fromisoformat(end_date)
-        df_subset = sub_date(start_date_object, end_date_object)
+        df_subset = sub_date(df, start_date_object, end_date_object)
     else:
         df_subset = df  # Use the entire DataFrame when no date range is selected
 
@@ -128,29 +136,16 @@ def serve_scatter(start_date, end_date, hue):
     summary_stats = df_subset[["AVGHR", "MAX_HR", "CAL"]].describe()
 
     # Convert summary statistics to a format suitable for Dash DataTable
-    data = summary_stats.reset_index().to_dict('records')
+    table_data = summary_stats.reset_index().to_dict('records')
     columns = [{"name": i, "id": i} for i in summary_stats.columns.insert(0, "index")]
 
-    return fig, data, columns
-
-def sub_date(start_date, end_date):
-    # Check if 'DATE' column exists
-    if 'DATE' not in df.columns:
-        raise ValueError("'DATE' column is missing from the DataFrame")
-
-    # Convert the 'DATE' column to datetime, handling errors
-    df['DATE'] = pd.to_datetime(df['DATE'], errors='coerce')
-
-    # Drop rows where conversion failed
-    df.dropna(subset=['DATE'], inplace=True)
-
-    # Convert datetime to date
-    df['DATE'] = df['DATE'].dt.date
+    return fig, table_data, columns
 
-    # Subset dates
-    df_subset = df[df['DATE'].between(start_date, end_date)]
-    return df_subset
+def sub_date(df, start_date, end_date):
+    # Subset whole dates by binary search on the sorted DATE column
+    return timeindex.between_dates(df, 'DATE', start_date, end_date)
 
 if __name__ == '__main__':
+    data.start()
     app.run(debug=True)
 
@@ -1,30 +1,39 @@
 import sqlite3
 import pandas as pd
-import pytz
+import timestamps
+import sqlquery
 
-def UZeppWrangle(db_path, start_date=None, end_date=None):
-    # Connect to database
-    conn = sqlite3.connect(db_path)
-    
-    # Construct query
-    query = "SELECT * FROM swings"
+# Columns the derived fields below are built from
+REQUIRED_COLUMNS = ['l_id', 'swing_type', 'swing_side',
+                    'impact_position_x', 'impact_position_y']
+
+def UZeppWrangle(db_path, start_date=None, end_date=None, columns=None, store=None):
+    # If no date range provided, use the default range
+    if not (start_date and end_date):
+        start_date, end_date = '2024-06-12', '2024-06-14'
     
-    # Read query results into DataFrame
-    df = pd.read_sql(query, conn)
-    df = df.sort_index()  
+    # Always select the columns the derived fields are built from
+    if columns is not None:
+        columns = REQUIRED_COLUMNS + [c for c in columns if c not in REQUIRED_COLUMNS]
     
-    # Convert l_id to datetime with explicit format
-    df['l_id'] = pd.to_datetime(df['l_id'], unit='ms')
+    # Serve from the columnar session store when it holds this sensor
+    if store:
+        import sessionstore
+        df = sessionstore.read_sensor(store, 'zepp', start_date, end_date, columns)
+        if df is not None:
+            return df
     
-    # Set timezone
-    az_timezone = pytz.timezone('America/Phoenix')
-    df['l_id'] = df['l_id'].dt.tz_localize('UTC').dt.tz_convert(az_timezone)
+    # Connect to database
+    conn = sqlite3.connect(db_path)
     
-    # Format datetime
-    df['l_id'] = df['l_id'].dt.strftime('%m-%d-%Y %I:%M:%S.%f %p')
+    # Push the date range and projection down into SQLite (l_id is epoch ms)
+    start_ms = timestamps.local_to_epoch(start_date, 'ms')
+    end_ms = timestamps.local_to_epoch(end_date, 'ms')
+    df = sqlquery.read_range(conn, 'swings', 'l_id', start_ms, end_ms, columns)
+    df = df.sort_index()  
     
-    # Convert back to datetime (now with consistent format)
-    df['l_id'] = pd.to_datetime(df['l_id'], format='%m-%d-%Y %I:%M:%S.%f %p')
+    # Convert l_id (epoch ms) to Phoenix local datetime64 in one step
+    df['l_id'] = timestamps.epoch_to_local(df['l_id'], 'ms')
     
     df.dropna(inplace=True)
     df = df.sort_values("l_id")
@@ -42,18 +51,18 @@ def UZeppWrangle(db_path, start_date=None, end_date=None):
     # Rename l_id to time
     df.rename(columns={'l_id': 'time'}, inplace=True)
     
-    # Filter the DataFrame based on the date range if provided
-    if start_date and end_date:
-        start_date = pd.to_datetime(start_date)
-        end_date = pd.to_datetime(end_date)
-        df = df[(df['time'] >= start_date) & (df['time'] <= end_date)]
-    else:
-        # If no date range provided, use the default range
-        df = df[(df['time'] > pd.to_datetime('2024-06-12')) & (df['time'] < pd.to_datetime('2024-06-14'))]
-    
-    # Format with fractional seconds to match Apple Watch
-    df['timestamp'] = df['time'].dt.strftime('%m-%d-%Y %I:%M:%S.%f %p')
+    # Same clock as the Apple Watch `timestamp` column, kept as datetime64
+    df['timestamp'] = df['time']
     
     conn.close()
     
     return df
+
+# Swings recorded after the high-water mark `after_l_id` (epoch ms), wrangled
+# the same way, and the new mark
+def UZeppSince(db_path, after_l_id, columns=None):
+    after = timestamps.epoch_to_local([after_l_id + 1], 'ms')[0]
+    df = UZeppWrangle(db_path, after, '2100-01-01', columns)
+    if df.empty:
+        return df, after_l_id
+    return df, int(timestamps.local_to_epoch(df['time'].max(), 'ms'))
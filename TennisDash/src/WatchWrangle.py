@@ -1,23 +1,119 @@
+import io
+import os
+import numpy as np
 import pandas as pd
-import pytz
-from datetime import datetime
+import timestamps
 
-def WatchWrangle(file_path, start_date=None, end_date=None):
-    # Read into DataFrame
-    df = pd.read_csv(file_path)
-    
-    # Convert Unix timestamps to datetime objects
-    df["timestamp"] = pd.to_datetime(df['time'], unit='ns')
-    
-    # Convert to desired timezone (America/Phoenix)
-    az_timezone = pytz.timezone('America/Phoenix')
-    df['timestamp'] = df['timestamp'].dt.tz_localize('UTC').dt.tz_convert(az_timezone)
+# Motion channels recorded in WristMotion.csv
+CHANNELS = [
+    'rotationRateX', 'rotationRateY', 'rotationRateZ',
+    'gravityX', 'gravityY', 'gravityZ',
+    'accelerationX', 'accelerationY', 'accelerationZ',
+    'quaternionW', 'quaternionX', 'quaternionY', 'quaternionZ',
+]
+
+# Explicit dtypes so pandas does not infer (and upcast) every chunk
+DTYPES = {'time': 'int64', 'seconds_elapsed': 'float64'}
+DTYPES.update({channel: 'float32' for channel in CHANNELS})
+
+# Rows parsed per chunk; peak memory of read_chunks is about one chunk, and
+# of read_window one chunk plus the kept window
+CHUNK_ROWS = 250_000
+
+# Stream the CSV in chunks and yield the rows of each with
+# start_ns <= time <= end_ns (chunks with none are skipped). Once the file
+# has been time-sorted so far and a chunk ends past end_ns, the rest of the
+# file cannot match and reading stops.
+def read_chunks(file_path, start_ns=None, end_ns=None, chunksize=CHUNK_ROWS, **read_args):
+    last_time = None
+    is_sorted = True
+    with pd.read_csv(file_path, dtype=DTYPES, chunksize=chunksize, **read_args) as reader:
+        for chunk in reader:
+            t = chunk['time'].to_numpy()
+            if len(t) == 0:
+                continue
+            mask = np.ones(len(t), dtype=bool)
+            if start_ns is not None:
+                mask &= t >= start_ns
+            if end_ns is not None:
+                mask &= t <= end_ns
+            if mask.all():
+                yield chunk
+            elif mask.any():
+                yield chunk[mask]
+
+            if is_sorted:
+                is_sorted = (last_time is None or t[0] >= last_time) and bool((np.diff(t) >= 0).all())
+            last_time = t[-1]
+            if is_sorted and end_ns is not None and last_time > end_ns:
+                break
+
+# The rows of read_chunks as one frame
+def read_window(file_path, start_ns=None, end_ns=None, chunksize=CHUNK_ROWS, **read_args):
+    kept = list(read_chunks(file_path, start_ns, end_ns, chunksize, **read_args))
+    if not kept:
+        return pd.DataFrame({c: pd.Series(dtype=d) for c, d in DTYPES.items()})
+    return pd.concat(kept, ignore_index=True)
+
+def WatchWrangle(file_path, start_date=None, end_date=None, store=None):
+    # Serve from the columnar session store when it holds this sensor
+    if store:
+        import sessionstore
+        df = sessionstore.read_sensor(store, 'watch', start_date, end_date)
+        if df is not None:
+            return df
     
-    # Filter the DataFrame based on the date range if provided
-    if start_date and end_date:
-        df = df[(df['timestamp'] >= start_date) & (df['timestamp'] <= end_date)]
+    # Stream into DataFrame, filtering on the raw ns column if a date range is provided
+    start_ns = timestamps.local_to_epoch(start_date, 'ns') if start_date else None
+    end_ns = timestamps.local_to_epoch(end_date, 'ns') if end_date else None
+    df = read_window(file_path, start_ns, end_ns)
     
-    # Format timestamp with fractional seconds
-    df['timestamp'] = df['timestamp'].dt.strftime('%m-%d-%Y %I:%M:%S.%f %p')
+    # Convert Unix ns timestamps to Phoenix local datetime64 in one step
+    df['timestamp'] = timestamps.epoch_to_local(df['time'], 'ns')
     
     return df
+
+# Read-only window onto bytes [start, end) of an open file, so pandas can
+# stream part of the CSV without the rest being read
+class FileSlice(io.RawIOBase):
+    def __init__(self, f, start, end):
+        f.seek(start)
+        self.f = f
+        self.left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.f.readinto(memoryview(buffer)[:min(len(buffer), self.left)])
+        self.left -= n
+        return n
+
+# Byte offset just past the last complete line, so a reader never starts mid-row
+def line_end_offset(file_path):
+    pos = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline >= 0:
+                return pos - step + newline + 1
+            pos -= step
+    return 0
+
+# Rows appended since byte `offset` (the persisted high-water mark), and the
+# new offset. Only complete lines are read; a shorter file means a fresh export.
+def WatchSince(file_path, offset=0):
+    end = line_end_offset(file_path)
+    if end < offset:
+        offset = 0
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        names = header.decode().strip().split(',')
+        start = max(offset, len(header))
+        end = max(end, start)
+        body = io.BufferedReader(FileSlice(f, start, end))
+        df = read_window(body, names=names, header=None)
+    df['timestamp'] = timestamps.epoch_to_local(df['time'], 'ns')
+    return df, end
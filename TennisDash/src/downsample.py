@@ -0,0 +1,37 @@
+import numpy as np
+
+# Downsampling of long time series for plotting: the lowest and highest
+# sample of each of n_out/2 equal buckets, so every peak and trough survives,
+# in a single vectorised pass. Returns sorted indices into the input, at most
+# about `n_out` of them, so x, y and any other column can be taken with the
+# same index. Buckets that are all NaN keep one NaN sample, so gaps stay gaps.
+MAX_POINTS = 2000
+
+
+def minmax_indices(y, n_out=MAX_POINTS):
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    buckets = n_out // 2
+    size = -(-n // buckets)
+    pad = buckets * size - n
+    y = np.asarray(y, dtype='float64')
+    missing = np.isnan(y)
+    low = np.pad(np.where(missing, np.inf, y), (0, pad), constant_values=np.inf)
+    high = np.pad(np.where(missing, -np.inf, y), (0, pad), constant_values=-np.inf)
+    start = np.arange(buckets) * size
+    idx = np.concatenate([start + low.reshape(buckets, size).argmin(axis=1),
+                          start + high.reshape(buckets, size).argmax(axis=1)])
+    return np.unique(np.minimum(idx, n - 1))
+
+
+# (start, end) of a graph's zoomed x range from its relayoutData, or None
+# when it shows the full range
+def zoom_range(relayout, axis='xaxis'):
+    if not relayout or relayout.get(f'{axis}.autorange'):
+        return None
+    if f'{axis}.range[0]' in relayout:
+        return relayout[f'{axis}.range[0]'], relayout[f'{axis}.range[1]']
+    if f'{axis}.range' in relayout:
+        return tuple(relayout[f'{axis}.range'])
+    return None
@@ -1,16 +1,35 @@
+import hashlib
+import logging
+import os
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
-import plotly.express as px
+import numpy as np
 import pandas as pd
 import sqlite3
-import WatchWrangle
 import UZeppWrangle
-from scipy.signal import find_peaks
+import samplestore
+import timestamps
+import lazydata
+import alignment
+import swingwindows
+import scalers
+import downsample
+import pyramid
+import figures
+import timeindex
+import sharedframes
 
-# Initialize Dash app
+# Clock-offset estimates; shown when run directly
+log = logging.getLogger(__name__)
+
+# Initialize Dash app; `server` is the WSGI app for gunicorn (main:server)
 app = dash.Dash(__name__)
+server = app.server
+
+# Line and peak traces, switched to WebGL above figures.WEBGL_POINTS points
+traces = figures.Traces()
 
 # Define available signals
 zepp_sensor_signals = [
@@ -38,34 +57,37 @@ all_signals = zepp_sensor_signals + zepp_calc_signals + available_signals
 # Load and process data
 Apple_path = "/home/blueaz/Downloads/SensorDownload/Compare/WristMotion.csv"
 UZepp_path = "/home/blueaz/Downloads/SensorDownload/Compare/ztennis.db"
+# Columnar store built by `python3 sessionstore.py ingest`; raw sources are used if absent
+Store_path = "/home/blueaz/Downloads/SensorDownload/SessionStore"
+# Memory-mapped store of all of the wrist-motion samples, built on first run
+# and extended with new CSV lines afterwards; shared with WatchDash, the date
+# window is sliced out of it
+Samples_path = "/home/blueaz/Downloads/SensorDownload/WristSamples"
+# Min/max/mean pyramid of the merged timeline's watch and Zepp dbg_* channels
+# (see pyramid.py), rebuilt whenever what it was built from changes; long
+# ranges are drawn from it
+Pyramid_path = "/home/blueaz/Downloads/SensorDownload/TennisPyramid"
+# The merged data is published here once and memory-mapped by every
+# gunicorn worker (see sharedframes.py); None, as when run directly, merges
+# it in each process instead
+Shared_path = "/dev/shm/TennisDash" if sharedframes.under_gunicorn() else None
+# The dashboard's code, which versions the shared data along with the
+# sources, so editing the wrangling or merging republishes it
+code_version = sharedframes.code_version(os.path.dirname(os.path.abspath(__file__)))
 start_date = '2024-06-12'
 end_date = '2024-06-14'
 
-dfa = WatchWrangle.WatchWrangle(Apple_path, start_date, end_date) 
-dfu = UZeppWrangle.UZeppWrangle(UZepp_path, start_date, end_date) 
 pd.set_option('display.max_columns', 100)
 pd.set_option('display.max_rows', 300)
 
-# General normalization function - written by GPT-4o
+# Ranges of the plotted signals, cached per signal and row range so that
+# redrawing the same window doesn't rescan it
+scaler_registry = scalers.ScalerRegistry()
+
+# General normalization function
 # Normalizes a column based on limits from another dataframe
 def normalize_column(dfa, dfb, ref_col, norm_col, new_col_name):
-    min_A = dfa[ref_col].min()
-    max_A = dfa[ref_col].max()
-    min_B = dfb[norm_col].min()
-    max_B = dfb[norm_col].max()
-    def normalize(x, min_B, max_B, min_A, max_A):
-        return ((x - min_B) * (max_A - min_A) / (max_B - min_B)) + min_A
-    dfb[new_col_name] = dfb[norm_col].apply(normalize,
-                                            args=(min_B, max_B, min_A, max_A))
-
-# Penalty function for center contact. Using Absolute value
-absx = 0 - dfu['impact_position_x'].abs()
-absy = 0 - dfu['impact_position_y'].abs()
-dfu['abs_imp'] = 0 + (absx + absy)
-#Normalize data based on inspection values chosen previously
-# Remove outliers found during data visualization
-dfu = dfu[dfu["dbg_acc_1"] < 10000]
-dfu = dfu[dfu["dbg_acc_3"] < 10000]
+    scalers.normalize_column(scaler_registry, dfa, dfb, ref_col, norm_col, new_col_name)
 
 # Zepp U sensor has raw sensor signals and calculated fields
 # create session and calc dataframes
@@ -76,24 +98,111 @@ sensor = ['time', 'dbg_acc_1', 'dbg_acc_2', 'dbg_acc_3', 'dbg_gyro_1',
 calc = [ 'backswing_time', 'power', 'ball_spin',
         'impact_position_x', 'impact_position_y',
        'racket_speed', 'impact_region']
-df_sensor = dfu[sensor]
-df_calc = dfu[calc]
 
-# Estimated by inspection
 tolerance = pd.Timedelta('5s')
+# Estimated by inspection; used for any session whose offset can't be
+# estimated with confidence from the data itself
 shift = -1 
 
-# Ensure the timestamps are in the same format
-pd.options.mode.chained_assignment = None  # default='warn'
-dfa['timestamp'] = pd.to_datetime(dfa['timestamp'], format='%m-%d-%Y %I:%M:%S.%f %p', errors='coerce')
-df_sensor['timestamp'] = pd.to_datetime(df_sensor['timestamp'], format='%m-%d-%Y %I:%M:%S.%f %p', errors='coerce')
-dfa['timestamp'] = dfa['timestamp'] - pd.Timedelta(seconds=shift) 
+def merge_data():
+    samples = samplestore.load(Samples_path, Apple_path, Store_path)
+    dfu = UZeppWrangle.UZeppWrangle(UZepp_path, start_date, end_date,
+                                    zepp_sensor_signals + zepp_calc_signals, store=Store_path)
+
+    # Penalty function for center contact. Using Absolute value
+    absx = 0 - dfu['impact_position_x'].abs()
+    absy = 0 - dfu['impact_position_y'].abs()
+    dfu['abs_imp'] = 0 + (absx + absy)
+    #Normalize data based on inspection values chosen previously
+    # Remove outliers found during data visualization
+    dfu = dfu[dfu["dbg_acc_1"] < 10000]
+    dfu = dfu[dfu["dbg_acc_3"] < 10000]
+    df_sensor = dfu[sensor]
+
+    # Only the watch timestamps take part in the merge; the channels stay in the
+    # sample store and row j of df_merged is sample sample_offset + j
+    pd.options.mode.chained_assignment = None  # default='warn'
+    sample_offset, sample_end = samples.date_range(start_date, end_date)
+    dfa = pd.DataFrame({'timestamp': timestamps.epoch_to_local(samples.time[sample_offset:sample_end])})
+
+    # Impacts show up as spikes in the watch's acceleration magnitude
+    magnitude = np.sqrt(sum(samples.channel(c, sample_offset, sample_end).astype('float64') ** 2
+                            for c in ['accelerationX', 'accelerationY', 'accelerationZ']))
+    estimates = alignment.estimate(df_sensor['timestamp'], dfa['timestamp'], magnitude)
+    log.info(alignment.format_estimates('watch', estimates, shift))
+    dfa['timestamp'] = alignment.shift_times(dfa['timestamp'], estimates, shift)
+
+    df_merged = pd.merge_asof(dfa, df_sensor,
+                              left_on='timestamp',
+                              right_on='timestamp',
+                              tolerance=tolerance,
+                              direction='nearest')
+
+    # Watch channels around every Zepp impact: (swings x samples x channels),
+    # gathered straight from the memory-mapped store
+    channels = [samples.channel(c, sample_offset, sample_end) for c in samples.channels]
+    windows, keep = swingwindows.extract(dfa['timestamp'], channels, df_sensor['timestamp'])
+    swings = {'windows': windows, 'time': df_sensor['timestamp'].to_numpy()[keep]}
+
+    # The Zepp rows and the clock offsets don't show in the merged times alone,
+    # so they identify the pyramid's source along with them
+    pyramid_channels = dict(zip(samples.channels, channels))
+    pyramid_channels.update({c: df_merged[c].to_numpy() for c in zepp_sensor_signals})
+    source = hashlib.sha1(pd.util.hash_pandas_object(df_sensor, index=False).to_numpy().tobytes()
+                          + repr(estimates).encode()).hexdigest()
+    pyramid.sync(Pyramid_path, df_merged['timestamp'], pyramid_channels, source=source)
+
+    return {'sample_offset': sample_offset, 'dfu': dfu, 'df_merged': df_merged, 'swings': swings}
+
+# The sources' sizes and mtimes, the date window and the fallback clock
+# offset version the merged data
+def data_version():
+    stats = [os.stat(path) for path in [Apple_path, UZepp_path]]
+    return '|'.join(f'{st.st_size}:{st.st_mtime_ns}' for st in stats) + f'|{start_date}..{end_date}|{shift:+g}'
+
+# The merged data, attached from the shared copy when it is up to date, with
+# the sample store and pyramid it was built with
+def load_data():
+    loaded = sharedframes.load(Shared_path, f'{data_version()}|{code_version}', merge_data)
+    loaded.update({'samples': samplestore.SampleStore(Samples_path),
+                   'pyramid': pyramid.Pyramid(Pyramid_path)})
+    return loaded
 
-df_merged = pd.merge_asof(dfa, df_sensor,
-                          left_on='timestamp',
-                          right_on='timestamp',
-                          tolerance=tolerance,
-                          direction='nearest')
+# Loaded in the background so the layout is served straight away
+data = lazydata.LazyData(load_data)
+
+# Values of one signal for merged rows [a, b): watch channels come from the
+# memory-mapped store, Zepp columns from df_merged
+def signal_data(loaded, signal, a, b):
+    samples, sample_offset = loaded['samples'], loaded['sample_offset']
+    if signal in samples.channels:
+        return samples.channel(signal, sample_offset + a, sample_offset + b)
+    if signal in loaded['df_merged'].columns:
+        return loaded['df_merged'][signal].to_numpy()[a:b]
+    return None
+
+# Datetimes as float nanoseconds, anything else as is
+def plot_values(values):
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.view('int64').astype('float64')
+    return values
+
+# Min-max scaling that ignores the NaN rows between swings; the (min, max)
+# is computed from the values unless given
+def normalize_data(values, value_range=None):
+    values = plot_values(values)
+    if value_range is None:
+        value_range = (np.nanmin(values), np.nanmax(values))
+    return scalers.rescale(values, value_range, (0, 1))
+
+# Range of a signal over merged rows [a, b): from the pyramid for the
+# channels it holds, otherwise fitted on the values and cached in the registry
+def signal_range(loaded, values, signal, a, b):
+    pyr = loaded['pyramid']
+    if signal in pyr.channels and b > a:
+        merged_ns = loaded['df_merged']['timestamp'].to_numpy().view('int64')
+        return pyr.range(signal, merged_ns[a], merged_ns[b - 1])
+    return scaler_registry.range('merged', signal, plot_values(values), f'{a}:{b}')
 
 
 # Layout for the Dash app
@@ -145,11 +254,28 @@ app.layout = html.Div([
         html.Label("Threshold"),
         dcc.Input(id='threshold', type='number', value=0.8),
     ]),
-    dcc.Graph(id='sensor-graph'),
+    dcc.Loading(dcc.Graph(id='sensor-graph')),
+    # What the graph shows (see figures.patch_groups)
+    dcc.Store(id='sensor-traces'),
+    html.Div([
+        html.Label("Swing number (within the date range)"),
+        dcc.Input(id='swing-number', type='number', min=0, step=1, value=0),
+    ]),
+    dcc.Loading(dcc.Graph(id='swing-graph')),
 ])
 
+# Windows of up to pyramid.RAW_ROWS rows are min-max downsampled to at most
+# downsample.MAX_POINTS points. Longer ones draw the pyramid's channels from
+# its finest level with at most pyramid.MAX_BUCKETS buckets in view, as the
+# mean with a min-max band, and find peaks in the bucket maxima, so zooming
+# in drills down level by level until the rows themselves are shown. Signals
+# the pyramid doesn't hold are always downsampled from the rows. The scaling
+# stays that of the whole date range. While the dates and the view stay the
+# same, the graph is patched: adding or removing a signal adds or removes
+# only its traces, and changing the peak settings replaces only the peaks.
 @app.callback(
-    Output('sensor-graph', 'figure'),
+    [Output('sensor-graph', 'figure'),
+     Output('sensor-traces', 'data')],
     [Input('x-axis-signal', 'value'),
      Input('y-axis-signal', 'value'),
      Input('additional-signals', 'value'),
@@ -157,64 +283,158 @@ app.layout = html.Div([
      Input('date-picker', 'end_date'),
      Input('peak-detection-signal', 'value'),
      Input('min-distance', 'value'),
-     Input('threshold', 'value')]
+     Input('threshold', 'value'),
+     Input('sensor-graph', 'relayoutData')],
+    [State('sensor-traces', 'data')]
 )
-def update_graph(x_signal, y_signal, additional_signals, start_date, end_date, peak_signal, min_distance, threshold):
-    # Filter data based on date range
-    dfm_filtered = df_merged[(df_merged['timestamp'] >= start_date) & (df_merged['timestamp'] <= end_date)]
+def update_graph(x_signal, y_signal, additional_signals, start_date, end_date, peak_signal, min_distance, threshold, relayout, shown):
+    # scipy is only needed once a graph is drawn
+    from scipy.signal import find_peaks
+
+    loaded = data.get()
+
+    # Resolve the date range, and any zoomed x range, to merged rows [a, b) and [c, d)
+    merged_time = loaded['df_merged']['timestamp'].to_numpy()
+    a, b = timeindex.span(merged_time, start_date, end_date)
+    c, d = a, b
+    zoom = downsample.zoom_range(relayout)
+    if zoom:
+        c, d = timeindex.span(merged_time, *zoom)
+        c = min(max(a, c), b)
+        d = max(min(b, d), c)
+
+    # Pyramid level for the visible rows, if there are too many to read
+    pyr = loaded['pyramid']
+    seconds = None
+    if d - c > pyramid.RAW_ROWS:
+        view_start, view_end = merged_time[[c, d - 1]].view('int64')
+        seconds = pyr.pick(view_start, view_end)
+        i, j = pyr.span(seconds, view_start, view_end)
+        level_time = (pyr.start[seconds][i:j] + seconds * pyramid.NS // 2).view('datetime64[ns]')
+    view = [a, b, c, d, seconds]
+
+    # X-axis data (use Zepp timestamp)
+    x_data = merged_time[c:d]
+
+    # Normalize one signal (once each: a trace's uid is its signal)
+    def add_signal(fig, signal):
+        values = signal_data(loaded, signal, a, b)
+        if values is None or len(values) == 0:
+            return
+        value_range = signal_range(loaded, values, signal, a, b)
+        if seconds is not None and signal in pyr.channels:
+            _, low, high, mean = pyr.read(seconds, signal, i, j)
+            traces.add(fig, f'{signal}/max', level_time, normalize_data(high, value_range),
+                       mode='lines', line=dict(width=0), legendgroup=signal, showlegend=False,
+                       hoverinfo='skip')
+            traces.add(fig, f'{signal}/min', level_time, normalize_data(low, value_range),
+                       mode='lines', line=dict(width=0), fill='tonexty', legendgroup=signal,
+                       showlegend=False, hoverinfo='skip')
+            traces.add(fig, f'{signal}/mean', level_time, normalize_data(mean, value_range),
+                       mode='lines', legendgroup=signal,
+                       name=f'Zepp {signal} ({seconds} s mean, min-max band)')
+            return
+        visible = values[c - a:d - a]
+        idx = downsample.minmax_indices(plot_values(visible))
+        traces.add(fig, signal, x_data[idx], normalize_data(visible[idx], value_range),
+                   mode='lines+markers', name=f'Zepp {signal} (Normalized)')
+
+    # Peak detection, in the bucket maxima when drawing from the pyramid
+    def add_peaks(fig):
+        signal = signal_data(loaded, peak_signal, a, b)
+        if signal is None or not len(signal):
+            return
+        value_range = signal_range(loaded, signal, peak_signal, a, b)
+        if seconds is not None and peak_signal in pyr.channels:
+            peak_time = level_time
+            signal_normalized = normalize_data(pyr.read(seconds, peak_signal, i, j)[2], value_range)
+            distance = max(1, int((min_distance or 1) // (swingwindows.RATE_HZ * seconds)))
+        else:
+            peak_time = x_data
+            signal_normalized = normalize_data(signal[c - a:d - a], value_range)
+            distance = min_distance
+        peaks, _ = find_peaks(signal_normalized, threshold=threshold, distance=distance)
+        # Keep the payload bounded: only the highest peaks if there are very many
+        if len(peaks) > downsample.MAX_POINTS:
+            peaks = np.sort(peaks[np.argsort(signal_normalized[peaks])[-downsample.MAX_POINTS:]])
+        traces.add(fig, 'peaks', peak_time[peaks], signal_normalized[peaks], mode='markers',
+                   marker=dict(color='purple', size=10, symbol='star'), name=f'Peaks ({peak_signal})')
+
+    # The selected y-axis signal, the additional Zepp signals and the peaks,
+    # which are redrawn whenever their settings change
+    wanted = {signal: None for signal in [y_signal] + (additional_signals or [])}
+    wanted['/peaks'] = [peak_signal, min_distance, threshold]
+
+    def build(fig, group):
+        if group == '/peaks':
+            add_peaks(fig)
+        else:
+            add_signal(fig, group)
+
+    # Same dates and view: patch in what changed
+    if shown and shown['view'] == view:
+        patch, drawn = figures.patch_groups(shown['groups'], wanted, build)
+        if patch is None:
+            return dash.no_update, dash.no_update
+        return patch, {'view': view, 'groups': drawn}
 
     # Initialize the figure
     fig = go.Figure()
+    drawn = figures.draw_groups(fig, wanted, build)
 
-    # X-axis data (use Zepp timestamp)
-    x_data = dfm_filtered['timestamp']
-
-    # Normalize the selected y-axis signal
-    y_data = dfm_filtered.get(y_signal, None)
-    if y_data is not None:
-        y_data_normalized = (y_data - y_data.min()) / (y_data.max() - y_data.min())
-        fig.add_trace(go.Scatter(
-            x=x_data,
-            y=y_data_normalized,
-            mode='lines+markers',
-            name=f'Zepp {y_signal} (Normalized)'
-        ))
-
-    # Add additional Zepp signals
-    if additional_signals:
-        for signal in additional_signals:
-            if signal in dfm_filtered.columns:
-                additional_y_data = dfm_filtered[signal]
-                additional_y_normalized = (additional_y_data - additional_y_data.min()) / (additional_y_data.max() - additional_y_data.min())
+    # Update layout of the figure; the zoom is kept while the dates stay the same
+    fig.update_layout(
+        title=f'Zepp Sensor Data Plot (Normalized) with Peak Detection',
+        xaxis_title='Timestamp',
+        xaxis_type='date',
+        yaxis_title='Normalized Value',
+        template='plotly',
+        uirevision=f'{start_date}|{end_date}'
+    )
+
+    # Long trace arrays go out as base64 typed arrays
+    return figures.encode(fig), {'view': view, 'groups': drawn}
+
+# One swing's window of the selected watch channels, from the swing tensor
+@app.callback(
+    Output('swing-graph', 'figure'),
+    [Input('y-axis-signal', 'value'),
+     Input('additional-signals', 'value'),
+     Input('date-picker', 'start_date'),
+     Input('date-picker', 'end_date'),
+     Input('swing-number', 'value')]
+)
+def update_swing_graph(y_signal, additional_signals, start_date, end_date, swing_number):
+    loaded = data.get()
+    swings, channels = loaded['swings'], loaded['samples'].channels
+    swing_time = swings['time']
+    a, b = timeindex.span(swing_time, start_date, end_date)
+
+    fig = go.Figure()
+    title = 'No swings with watch data in range'
+    if b > a:
+        k = a + min(max(int(swing_number or 0), 0), b - a - 1)
+        seconds = swingwindows.window_seconds()
+        for signal in [y_signal] + (additional_signals or []):
+            if signal in channels:
                 fig.add_trace(go.Scatter(
-                    x=x_data,
-                    y=additional_y_normalized,
-                    mode='lines+markers',
-                    name=f'Zepp {signal} (Normalized)'
+                    x=seconds,
+                    y=normalize_data(swings['windows'][k, :, channels.index(signal)]),
+                    mode='lines',
+                    name=signal
                 ))
+        fig.add_vline(x=0, line_dash='dash', line_color='purple')
+        title = f'Swing {k - a} of {b - a} at {pd.Timestamp(swing_time[k])} (Normalized)'
 
-    # Peak detection
-    if peak_signal in dfm_filtered.columns:
-        signal = dfm_filtered[peak_signal]
-        signal_normalized = (signal - signal.min()) / (signal.max() - signal.min())
-        peaks, _ = find_peaks(signal_normalized, threshold=threshold, distance=min_distance)
-        fig.add_trace(go.Scatter(
-            x=x_data[peaks],
-            y=signal_normalized[peaks],
-            mode='markers',
-            marker=dict(color='purple', size=10, symbol='star'),
-            name=f'Peaks ({peak_signal})'
-        ))
-
-    # Update layout of the figure
     fig.update_layout(
-        title=f'Zepp Sensor Data Plot (Normalized) with Peak Detection',
-        xaxis_title='Timestamp',
+        title=title,
+        xaxis_title='Seconds from impact',
         yaxis_title='Normalized Value',
         template='plotly'
     )
-
     return fig
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    data.start()
     app.run_server(debug=True)
@@ -0,0 +1,56 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from alignment import as_ns
+
+# Fixed windows of watch samples around each Zepp impact, as one contiguous
+# float32 array of shape (swings, samples, channels). Impacts are located in
+# the sorted sample times with searchsorted and each channel is gathered from
+# a strided sliding-window view, so only the windows themselves are copied
+# (and, for memory-mapped channels, only their pages are read).
+RATE_HZ = 100
+PRE_S = 1.0
+POST_S = 1.0
+
+
+# Sample offsets of a window relative to the impact sample
+def window_offsets(pre_s=PRE_S, post_s=POST_S, rate_hz=RATE_HZ):
+    return np.arange(-int(round(pre_s * rate_hz)), int(round(post_s * rate_hz)) + 1)
+
+
+# Same, in seconds, for plotting
+def window_seconds(pre_s=PRE_S, post_s=POST_S, rate_hz=RATE_HZ):
+    return window_offsets(pre_s, post_s, rate_hz) / rate_hz
+
+
+# First sample of each impact's window, and which impacts have a complete
+# window: a sample within one period of the impact, enough samples on both
+# sides and no gap in the recording inside the window
+def locate(sample_ns, impact_ns, pre, width, rate_hz=RATE_HZ):
+    n = len(sample_ns)
+    if n < width:
+        return np.empty(0, dtype='int64'), np.zeros(len(impact_ns), dtype=bool)
+    period = 1_000_000_000 / rate_hz
+    after = np.clip(np.searchsorted(sample_ns, impact_ns), 1, n - 1)
+    nearest = after - (impact_ns - sample_ns[after - 1] < sample_ns[after] - impact_ns)
+    start = nearest - pre
+    keep = (start >= 0) & (start + width <= n)
+    keep &= np.abs(sample_ns[nearest] - impact_ns) <= period
+    clipped = np.clip(start, 0, n - width)
+    keep &= sample_ns[clipped + width - 1] - sample_ns[clipped] <= 1.5 * (width - 1) * period
+    return start[keep], keep
+
+
+# (swings x samples x channels) float32 windows of `channels` (equal-length
+# 1-D arrays or memmaps, in sample order) around `impact_times`. Returns the
+# tensor and a mask over impact_times of the swings it holds.
+def extract(sample_times, channels, impact_times, pre_s=PRE_S, post_s=POST_S, rate_hz=RATE_HZ):
+    sample_ns = as_ns(sample_times)
+    impact_ns = as_ns(impact_times)
+    offsets = window_offsets(pre_s, post_s, rate_hz)
+    width = len(offsets)
+    starts, keep = locate(sample_ns, impact_ns, -offsets[0], width, rate_hz)
+    windows = np.empty((len(starts), width, len(channels)), dtype='float32')
+    if len(starts):
+        for c, values in enumerate(channels):
+            windows[:, :, c] = sliding_window_view(values, width)[starts]
+    return windows, keep
@@ -0,0 +1,113 @@
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+from _plotly_utils.optional_imports import get_module
+import figures
+import samplestore
+
+# Payload size and encode/decode time of a full-rate session figure (every
+# sample of three channels against local timestamps, no downsampling) sent as
+# plotly's JSON lists and ISO strings versus figures.encode()'s base64 typed
+# arrays, each with the json and, if installed, orjson engines.
+# Decoding is timed in node when it is on the PATH: JSON.parse, then the
+# typed arrays' base64 into Float32/Float64Arrays, or the ISO strings through
+# Date.parse, which is what plotly.js does with each in the browser.
+# Usage: python3 bench_serialize.py [sample store directory]
+# Without a store, a synthetic two-hour 100 Hz session is used.
+CHANNELS = ['accelerationX', 'accelerationY', 'accelerationZ']
+REPEAT = 3
+
+NODE_DECODE = """
+const fs = require('fs');
+const text = fs.readFileSync(process.argv[1], 'utf8');
+const t0 = process.hrtime.bigint();
+const fig = JSON.parse(text);
+let n = 0;
+for (const trace of fig.data) {
+  for (const key of ['x', 'y']) {
+    const v = trace[key];
+    if (v && v.bdata) {
+      const bytes = Buffer.from(v.bdata, 'base64');
+      const arr = v.dtype === 'f8' ? new Float64Array(bytes.buffer, bytes.byteOffset, bytes.length / 8)
+                                   : new Float32Array(bytes.buffer, bytes.byteOffset, bytes.length / 4);
+      n += arr.length;
+    } else if (typeof v[0] === 'string') {
+      for (const s of v) { n += Date.parse(s) > 0; }
+    } else {
+      n += v.length;
+    }
+  }
+}
+console.log(Number(process.hrtime.bigint() - t0) / 1e9, n);
+"""
+
+
+def session():
+    if len(sys.argv) > 1:
+        samples = samplestore.SampleStore(sys.argv[1])
+        time_ns = np.asarray(samples.time)
+        return time_ns.astype('datetime64[ns]'), {c: np.asarray(samples.channel(c, 0, len(time_ns))) for c in CHANNELS}
+    n = 2 * 3600 * 100
+    rng = np.random.default_rng(0)
+    t = pd.Timestamp('2024-06-12 09:00').to_datetime64() + np.arange(n) * np.timedelta64(10, 'ms')
+    return t, {c: rng.normal(size=n).astype('float32') for c in CHANNELS}
+
+
+def best(fn):
+    times = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+
+def node_decode(payload):
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        f.write(payload)
+    try:
+        runs = [float(subprocess.run(['node', '-e', NODE_DECODE, f.name], capture_output=True,
+                                     text=True, check=True).stdout.split()[0]) for _ in range(REPEAT)]
+        return min(runs)
+    finally:
+        os.unlink(f.name)
+
+
+t, channels = session()
+fig = go.Figure()
+for c, values in channels.items():
+    fig.add_trace(go.Scattergl(x=t, y=values, mode='lines', name=c))
+fig.update_layout(template='plotly')
+print(f"{len(t):,} samples x {len(channels)} channels")
+
+engines = ['json'] + (['orjson'] if get_module('orjson') else [])
+has_node = shutil.which('node') is not None
+print(f"{'path':<22} {'MB':>8} {'encode s':>9} {'py decode s':>12} {'node decode s':>14}")
+for typed in [False, True]:
+    for engine in engines:
+        if typed:
+            seconds, payload = best(lambda: to_json_plotly(figures.encode(fig), engine=engine))
+        else:
+            seconds, payload = best(lambda: to_json_plotly(fig, engine=engine))
+
+        def py_decode():
+            out = json.loads(payload)
+            for trace in out['data']:
+                for key in ('x', 'y'):
+                    v = trace[key]
+                    if isinstance(v, dict):
+                        np.frombuffer(base64.b64decode(v['bdata']), dtype='<' + v['dtype'])
+            return out
+        decode_seconds, _ = best(py_decode)
+        node_seconds = f"{node_decode(payload):>14.3f}" if has_node else f"{'-':>14}"
+        name = f"{'typed arrays' if typed else 'lists'} + {engine}"
+        print(f"{name:<22} {len(payload) / 1e6:>8.1f} {seconds:>9.3f} {decode_seconds:>12.3f} {node_seconds}")
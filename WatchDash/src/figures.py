@@ -0,0 +1,185 @@
+import base64
+import threading
+import numpy as np
+import plotly.graph_objects as go
+from dash import Patch
+
+# Trace construction for the dashboards' figures. Above WEBGL_POINTS points a
+# trace is drawn with WebGL (go.Scattergl, or render_mode='webgl' in plotly
+# express), which stays responsive into the millions of points, where SVG,
+# with a DOM node per marker, stalls past a few tens of thousands. Smaller
+# traces stay SVG, which is sharper and has no WebGL context to set up.
+# Set figures.WEBGL_POINTS to move the threshold for a whole dashboard, or pass
+# `threshold` for one figure.
+WEBGL_POINTS = 10_000
+
+# Trace arrays of at least TYPED_ARRAY_POINTS values are sent as base64 typed
+# arrays ({'dtype', 'bdata'}, decoded natively by plotly.js >= 2.28, which
+# Dash 2.17 ships) instead of JSON lists: float32 for values, float64 epoch ms
+# for datetimes (plotly.js has no int64 arrays; ms stay exact in float64)
+# instead of ISO strings. See encode(); the rest of the figure is serialised
+# by plotly's orjson engine when orjson is installed.
+TYPED_ARRAY_POINTS = 100
+
+
+def use_webgl(n_points, threshold=None):
+    return n_points > (WEBGL_POINTS if threshold is None else threshold)
+
+
+# render_mode argument for px.scatter/px.line
+def render_mode(n_points, threshold=None):
+    return 'webgl' if use_webgl(n_points, threshold) else 'svg'
+
+
+# One trace per key (a signal, or a signal's band edge) kept across callbacks.
+# A template trace is built once per key, kind (SVG or WebGL) and style, so a
+# redraw doesn't assemble the style again; plotly still validates the copy
+# added to the figure and the data attached to it. The uid stays the key,
+# so plotly.js updates the trace in place on a redraw instead of removing and
+# re-creating it (and, for WebGL, its buffers).
+class Traces:
+    def __init__(self, threshold=None):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.templates = {}
+
+    # Add the trace for `key` holding x and y to `fig` and return it
+    def add(self, fig, key, x, y, **style):
+        kind = go.Scattergl if use_webgl(len(x), self.threshold) else go.Scatter
+        with self.lock:
+            cached = self.templates.get((key, kind))
+            if cached is None or cached[0] != style:
+                cached = (style, kind(uid=str(key), **style))
+                self.templates[(key, kind)] = cached
+        fig.add_trace(cached[1])
+        trace = fig.data[-1]
+        trace.update(x=x, y=y)
+        return trace
+
+
+def _typed_array(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype('datetime64[ms]').view('int64').astype('<f8')
+        values[values == np.iinfo('int64').min] = np.nan  # NaT
+        dtype = 'f8'
+    elif np.issubdtype(values.dtype, np.integer) and len(values) and \
+            np.iinfo('int32').min <= values.min() and values.max() <= np.iinfo('int32').max:
+        values, dtype = values.astype('<i4'), 'i4'
+    else:
+        values, dtype = values.astype('<f4'), 'f4'
+    return {'dtype': dtype, 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+
+# One trace as a dict, its long numeric and datetime arrays as typed arrays;
+# returns (trace, whether its x holds datetimes)
+def encode_trace(trace):
+    trace = trace.to_plotly_json()
+    dates = False
+    for key in ('x', 'y'):
+        values = trace.get(key)
+        if isinstance(values, np.ndarray) and len(values) >= TYPED_ARRAY_POINTS and \
+                values.dtype.kind in 'iufM':
+            dates = dates or (key == 'x' and values.dtype.kind == 'M')
+            trace[key] = _typed_array(values)
+    return trace, dates
+
+
+# Figure as a dict ready for Dash, with typed arrays (see TYPED_ARRAY_POINTS).
+# An x axis given as epoch ms is declared a date axis, which plotly.js would
+# otherwise infer from the ISO strings.
+def encode(fig):
+    figure = fig.to_plotly_json()
+    encoded = [encode_trace(trace) for trace in fig.data]
+    figure['data'] = [trace for trace, _ in encoded]
+    if any(dates for _, dates in encoded):
+        figure['layout'].setdefault('xaxis', {})['type'] = 'date'
+    return figure
+
+
+# Figures drawn as groups of traces (a signal's line, or its band edges and
+# mean; the peak markers), updated in place with dash.Patch. The groups in the
+# figure are kept in a dcc.Store next to the graph as [group, traces,
+# signature] in figure order; `wanted` maps the groups to draw, in order, to
+# a JSON-able signature of whatever else their traces depend on (e.g. peak
+# detection settings). build(fig, group) adds a group's traces to fig.
+
+# Draw every group into fig; returns the store's list
+def draw_groups(fig, wanted, build):
+    drawn = []
+    for group, signature in wanted.items():
+        before = len(fig.data)
+        build(fig, group)
+        drawn.append([group, len(fig.data) - before, signature])
+    return drawn
+
+
+# Patch taking the figure from `drawn` to `wanted`: removes the groups no
+# longer wanted, redraws those whose signature changed and appends new ones,
+# so only their traces are built and sent. Returns (patch, drawn), or
+# (None, drawn) when nothing changed.
+def patch_groups(drawn, wanted, build):
+    patch = Patch()
+    changed = False
+
+    def traces_of(group):
+        fig = go.Figure()
+        build(fig, group)
+        return [encode_trace(trace)[0] for trace in fig.data]
+
+    # Removals first, from the end, so earlier indices stay valid
+    start = sum(count for _, count, _ in drawn)
+    for group, count, _ in reversed(drawn):
+        start -= count
+        if group not in wanted:
+            for k in reversed(range(start, start + count)):
+                del patch['data'][k]
+            changed = True
+    kept = [entry for entry in drawn if entry[0] in wanted]
+
+    start = 0
+    for entry in kept:
+        group, count, signature = entry
+        if signature != wanted[group]:
+            new = traces_of(group)
+            for k in reversed(range(start, start + count)):
+                del patch['data'][k]
+            for k, trace in enumerate(new):
+                patch['data'].insert(start + k, trace)
+            entry[1:] = [len(new), wanted[group]]
+            changed = True
+        start += entry[1]
+
+    for group in wanted:
+        if not any(entry[0] == group for entry in kept):
+            new = traces_of(group)
+            patch['data'].extend(new)
+            kept.append([group, len(new), wanted[group]])
+            changed = True
+    return (patch if changed else None), kept
+
+
+def _int32_base64(values):
+    return base64.b64encode(np.asarray(values, dtype='<i4').tobytes()).decode('ascii')
+
+
+# dcc.Store payload for the clientside histogram (assets/histogram.js): fine
+# bins at `position` (integers on one grid, bin p spanning start + p * width
+# to start + (p + 1) * width) and their counts per trace, as base64 Int32
+# arrays. The browser merges them into as many bins as the slider asks for.
+# `title` may hold {bins}; `is_time`: start and width are ns since the epoch.
+def histogram_data(start, width, position, counts, title, is_time=False, **layout):
+    if is_time:
+        start, width = start / 1e6, width / 1e6  # date axes are in ms
+        layout['xaxis_type'] = 'date'
+    fig = go.Figure(layout=layout)
+    fig.update_layout(barmode='relative', bargap=0, yaxis_title='count')
+    return {
+        'start': float(start),
+        'width': float(width),
+        'position': _int32_base64(position),
+        'names': [str(name) for name in counts],
+        'counts': {str(name): _int32_base64(c) for name, c in counts.items()},
+        'title': title,
+        'layout': fig.to_plotly_json()['layout'],
+    }
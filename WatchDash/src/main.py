@@ -1,18 +1,32 @@
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
-import pandas as pd
-import WatchWrangle  # Assuming this module processes Apple Watch data
+import samplestore
+import timestamps
+import lazydata
+import downsample
+import pyramid
+import figures
 
 # Load and process Apple Watch data
 Apple_path = "/home/blueaz/Downloads/SensorDownload/Compare/WristMotion.csv"
-start_date = '2024-06-11'
-end_date = '2024-06-15'
-dfa = WatchWrangle.WatchWrangle(Apple_path, start_date, end_date)
+# Columnar store built by `python3 sessionstore.py ingest`; the CSV is used if absent
+Store_path = "/home/blueaz/Downloads/SensorDownload/SessionStore"
+# Memory-mapped sample store of all of the watch data, built on first run and
+# extended with new CSV lines afterwards; shared with TennisDash
+Samples_path = "/home/blueaz/Downloads/SensorDownload/WristSamples"
+# Min/max/mean pyramid of the sample store (see pyramid.py), brought up to
+# date with it on every start; long ranges are drawn from it
+Pyramid_path = "/home/blueaz/Downloads/SensorDownload/WristPyramid"
 
-# Ensure the timestamp column is in datetime format
-dfa['timestamp'] = pd.to_datetime(dfa['timestamp'], format='%m-%d-%Y %I:%M:%S.%f %p')
+def load_samples():
+    samples = samplestore.load(Samples_path, Apple_path, Store_path)
+    pyramid.sync(Pyramid_path, samples.time, samples.values)
+    return {'samples': samples, 'pyramid': pyramid.Pyramid(Pyramid_path)}
+
+# Loaded in the background so the layout is served straight away
+data = lazydata.LazyData(load_samples)
 
 # Define available signals based on the provided columns
 available_signals = [
@@ -23,12 +37,41 @@ available_signals = [
     'timestamp'
 ]
 
-# Function to normalize data using min-max scaling
-def normalize_data(series):
-    return (series - series.min()) / (series.max() - series.min())
+# Function to normalize data using min-max scaling, given the (min, max)
+def normalize_data(values, value_range):
+    low, high = value_range
+    return (values.astype('float64') - low) / (high - low)
+
+# Values of one signal for sample rows [lo, hi), as zero-copy memmap views
+def signal_data(samples, signal, lo, hi):
+    if signal == 'timestamp':
+        return samples.time[lo:hi]
+    if signal in samples.channels:
+        return samples.channel(signal, lo, hi)
+    return None
+
+# (start, min, max, mean) of one signal over start_ns..end_ns at a pyramid level
+def level_data(pyr, signal, seconds, start_ns, end_ns):
+    i, j = pyr.span(seconds, start_ns, end_ns)
+    if signal == 'timestamp':
+        start = pyr.start[seconds][i:j]
+        return start, start, start, start
+    if signal in pyr.channels:
+        return pyr.read(seconds, signal, i, j)
+    return None
+
+# (min, max) of one signal over start_ns..end_ns, from the pyramid
+def signal_range(pyr, signal, start_ns, end_ns):
+    if signal == 'timestamp':
+        return start_ns, end_ns
+    return pyr.range(signal, start_ns, end_ns)
+
+# Line traces, switched to WebGL above figures.WEBGL_POINTS points
+traces = figures.Traces()
 
-# Initialize Dash app
+# Initialize Dash app; `server` is the WSGI app for gunicorn (main:server)
 app = dash.Dash(__name__)
+server = app.server
 
 # Layout for the Dash app
 app.layout = html.Div([
@@ -63,60 +106,105 @@ app.layout = html.Div([
             multi=True
         ),
     ]),
-    dcc.Graph(id='sensor-graph'),
+    dcc.Loading(dcc.Graph(id='sensor-graph')),
+    # What the graph shows (see figures.patch_groups)
+    dcc.Store(id='sensor-traces'),
 ])
 
-# Update the graph when the user selects signals
+# Update the graph when the user selects signals or zooms. Windows of up to
+# pyramid.RAW_ROWS samples are min-max downsampled from the samples; longer
+# ones are drawn from the finest pyramid level with at most
+# pyramid.MAX_BUCKETS buckets in view, as the mean with a min-max band, so a
+# multi-week overview reads a few hundred coarse buckets and zooming in drills
+# down level by level until the samples themselves are shown. The scaling is
+# that of the whole date range, taken from the pyramid. While the dates and
+# the view stay the same, adding or removing a signal only sends a patch
+# adding or removing its traces.
 @app.callback(
-    Output('sensor-graph', 'figure'),
+    [Output('sensor-graph', 'figure'),
+     Output('sensor-traces', 'data')],
     [Input('x-axis-signal', 'value'),
      Input('y-axis-signal', 'value'),
      Input('additional-signals', 'value'),
      Input('date-picker', 'start_date'),
-     Input('date-picker', 'end_date')]
+     Input('date-picker', 'end_date'),
+     Input('sensor-graph', 'relayoutData')],
+    [State('sensor-traces', 'data')]
 )
-def update_graph(x_signal, y_signal, additional_signals, start_date, end_date):
-    # Filter data based on date range and ensure timestamp filtering works
-    dfa_filtered = dfa[(dfa['timestamp'] >= pd.to_datetime(start_date)) & (dfa['timestamp'] <= pd.to_datetime(end_date))]
+def update_graph(x_signal, y_signal, additional_signals, start_date, end_date, relayout, shown):
+    loaded = data.get()
+    samples, pyr = loaded['samples'], loaded['pyramid']
+
+    # The date range and the visible (zoomed) part of it as epoch ns, and the
+    # sample rows [view_lo, view_hi) in view
+    start_ns = timestamps.local_to_epoch(start_date, 'ns')
+    end_ns = timestamps.local_to_epoch(end_date, 'ns')
+    view_start, view_end = start_ns, end_ns
+    zoom = downsample.zoom_range(relayout)
+    if zoom:
+        view_start = min(max(start_ns, timestamps.local_to_epoch(zoom[0], 'ns')), end_ns)
+        view_end = max(min(end_ns, timestamps.local_to_epoch(zoom[1], 'ns')), view_start)
+    view_lo, view_hi = samples.locate(view_start, view_end)
+    seconds = None if view_hi - view_lo <= pyramid.RAW_ROWS else pyr.pick(view_start, view_end)
+    view = [start_ns, end_ns, view_start, view_end, seconds]
+
+    # Normalize and plot one signal (once each: a trace's uid is its signal)
+    def add_signal(fig, signal):
+        value_range = signal_range(pyr, signal, start_ns, end_ns)
+        if seconds is None:
+            visible = signal_data(samples, signal, view_lo, view_hi)
+            if visible is None or len(visible) == 0:
+                return
+            idx = downsample.minmax_indices(visible)
+            traces.add(fig, signal,
+                       timestamps.epoch_to_local(samples.time[view_lo:view_hi][idx]),
+                       normalize_data(visible[idx], value_range),
+                       mode='lines+markers', name=signal)
+            return
+        level = level_data(pyr, signal, seconds, view_start, view_end)
+        if level is None or len(level[0]) == 0:
+            return
+        start, low, high, mean = level
+        x = timestamps.epoch_to_local(start + seconds * pyramid.NS // 2)
+        traces.add(fig, f'{signal}/max', x, normalize_data(high, value_range), mode='lines',
+                   line=dict(width=0), legendgroup=signal, showlegend=False, hoverinfo='skip')
+        traces.add(fig, f'{signal}/min', x, normalize_data(low, value_range), mode='lines',
+                   line=dict(width=0), fill='tonexty', legendgroup=signal,
+                   showlegend=False, hoverinfo='skip')
+        traces.add(fig, f'{signal}/mean', x, normalize_data(mean, value_range), mode='lines',
+                   legendgroup=signal, name=f'{signal} ({seconds} s mean, min-max band)')
+
+    # The selected y-axis signal and any additional signals
+    wanted = {signal: None for signal in [y_signal] + (additional_signals or [])}
+
+    # Same dates and view: patch in the signals that changed
+    if shown and shown['view'] == view:
+        patch, drawn = figures.patch_groups(shown['groups'], wanted, add_signal)
+        if shown['y_signal'] != y_signal:
+            patch = patch or dash.Patch()
+            patch['layout']['yaxis']['title']['text'] = f'Normalized {y_signal}'
+        if patch is None:
+            return dash.no_update, dash.no_update
+        return patch, {'view': view, 'groups': drawn, 'y_signal': y_signal}
 
     # Initialize the figure
     fig = go.Figure()
+    drawn = figures.draw_groups(fig, wanted, add_signal)
 
-    # X-axis data (use timestamp)
-    x_data = dfa_filtered['timestamp']
-
-    # Normalize and plot the selected y-axis signal
-    if y_signal in dfa_filtered.columns:
-        y_data = normalize_data(dfa_filtered[y_signal])
-        fig.add_trace(go.Scatter(
-            x=x_data,
-            y=y_data,
-            mode='lines+markers',
-            name=y_signal
-        ))
-
-    # Normalize and add additional signals
-    if additional_signals:
-        for signal in additional_signals:
-            if signal in dfa_filtered.columns:
-                normalized_signal = normalize_data(dfa_filtered[signal])
-                fig.add_trace(go.Scatter(
-                    x=x_data,
-                    y=normalized_signal,
-                    mode='lines+markers',
-                    name=signal
-                ))
-
-    # Update layout of the figure
+    # Update layout of the figure; the zoom is kept while the dates stay the same
     fig.update_layout(
         title='Apple Watch Sensor Data Plot (Normalized)',
         xaxis_title='Timestamp',
+        xaxis_type='date',
         yaxis_title=f'Normalized {y_signal}',
-        template='plotly'
+        template='plotly',
+        uirevision=f'{start_date}|{end_date}'
     )
 
-    return fig
+    # Long trace arrays go out as base64 typed arrays
+    return figures.encode(fig), {'view': view, 'groups': drawn, 'y_signal': y_signal}
 
 if __name__ == '__main__':
+    data.start()
     app.run_server(debug=True)
 
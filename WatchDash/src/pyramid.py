@@ -0,0 +1,267 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import numpy as np
+
+# Persisted min/max/mean level-of-detail pyramid over a sorted timeline.
+#   meta.json       levels, channel order, bucket count per level, and the row
+#                   count and first/last time of the samples it was built from
+#   L<s>/start.i8   int64 start (ns) of each non-empty bucket of s seconds
+#   L<s>/min.f4     float32 (buckets x channels) minimum, NaNs ignored
+#   L<s>/max.f4     maximum
+#   L<s>/mean.f4    mean
+#   L<s>/count.i4   int32 number of non-NaN samples behind each value
+# Only non-empty buckets are stored, so the gaps between sessions cost
+# nothing. The finest level is built from the samples in chunks and every
+# coarser level from the one below it. Each level divides the next, so
+# appending samples only recomputes the last bucket of the coarsest level.
+# Files are memory-mapped read-only, and an overview of any length reads at
+# most MAX_BUCKETS buckets of the coarsest level that fits. sync() holds
+# <path>.lock while it writes, so processes bringing the same pyramid up to
+# date take turns; one that finds it up to date doesn't take the lock.
+LEVELS = [1, 10, 60, 600, 3600, 86400]
+# Buckets drawn per trace; each gives a min and a max point, as in downsample.py
+MAX_BUCKETS = 1000
+# Windows with at most this many samples are drawn from the samples themselves
+RAW_ROWS = 20_000
+NS = 1_000_000_000
+CHUNK = 1 << 18
+STATS = [('min', 'float32'), ('max', 'float32'), ('mean', 'float32'), ('count', 'int32')]
+
+
+def exists(path):
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+
+def _as_ns(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype('datetime64[ns]').view('int64')
+    return values.astype('int64', copy=False)
+
+
+# Start of each run of equal keys
+def _runs(key):
+    return np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+
+
+# Stats of `seconds`-long buckets straight from samples: (times, rows x channels)
+def _from_samples(time_ns, values, seconds):
+    key = time_ns // (seconds * NS)
+    first = _runs(key)
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid.astype('int32'), first, axis=0)
+    total = np.add.reduceat(np.where(valid, values, 0), first, axis=0, dtype='float64')
+    with np.errstate(invalid='ignore'):
+        mean = total / count
+    return {'start': key[first] * seconds * NS,
+            'min': np.fmin.reduceat(values, first, axis=0),
+            'max': np.fmax.reduceat(values, first, axis=0),
+            'mean': mean, 'count': count}
+
+
+# Stats of coarser buckets from the stats of finer ones
+def _coarsen(level, seconds):
+    key = level['start'] // (seconds * NS)
+    first = _runs(key)
+    count = np.add.reduceat(level['count'], first, axis=0)
+    total = np.add.reduceat(np.where(level['count'] > 0, level['mean'] * level['count'], 0), first, axis=0)
+    with np.errstate(invalid='ignore'):
+        mean = total / count
+    return {'start': key[first] * seconds * NS,
+            'min': np.fmin.reduceat(level['min'], first, axis=0),
+            'max': np.fmax.reduceat(level['max'], first, axis=0),
+            'mean': mean, 'count': count}
+
+
+# Finest level for samples [lo, n), read CHUNK rows at a time and cut on
+# bucket boundaries so no bucket is split between chunks
+def _finest(time, channels, seconds, lo):
+    parts = []
+    n = len(time)
+    while lo < n:
+        hi = min(lo + CHUNK, n)
+        if hi < n:
+            edge = (int(time[hi - 1]) // (seconds * NS) + 1) * seconds * NS
+            hi = int(np.searchsorted(time, edge, side='left'))
+        values = np.column_stack([np.asarray(channels[c][lo:hi], dtype='float32') for c in channels])
+        parts.append(_from_samples(time[lo:hi], values, seconds))
+        lo = hi
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+# Recompute every bucket from time `cutoff` on, from samples [lo, n), and
+# write it over the tail of each level's files. Buckets before the cutoff
+# stay as they are; the files only ever grow, so open readers stay valid.
+def _write(path, meta, time, channels, lo, cutoff):
+    level = None
+    for k, seconds in enumerate(meta['levels']):
+        level = _finest(time, channels, seconds, lo) if level is None else _coarsen(level, seconds)
+        level_dir = os.path.join(path, f'L{seconds}')
+        keep = 0
+        if meta['buckets'][k]:
+            start = np.memmap(os.path.join(level_dir, 'start.i8'), dtype='int64', mode='r',
+                              shape=(meta['buckets'][k],))
+            keep = int(np.searchsorted(start, cutoff, side='left'))
+            del start
+        for name, dtype in [('start', 'int64')] + STATS:
+            ext = 'i8' if name == 'start' else dtype[0] + '4'
+            values = np.ascontiguousarray(level[name], dtype=dtype)
+            with open(os.path.join(level_dir, f'{name}.{ext}'), 'r+b') as f:
+                f.seek(keep * values.itemsize * (1 if name == 'start' else len(channels)))
+                values.tofile(f)
+        meta['buckets'][k] = keep + len(level['start'])
+    meta['rows'] = len(time)
+    meta['first'] = int(time[0])
+    meta['last'] = int(time[-1])
+    write_meta(path, meta)
+
+
+# Exclusive lock on the pyramid at `path` while it is written. It is a
+# sibling file because build() replaces the directory.
+@contextlib.contextmanager
+def locked(path):
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+# Build the pyramid of `channels` ({name: 1-D array or memmap}) over the
+# sorted `time` at `path`, in a temporary directory renamed into place
+def build(path, time, channels, levels=LEVELS, source=None):
+    time = _as_ns(time)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    for seconds in levels:
+        os.makedirs(os.path.join(tmp, f'L{seconds}'))
+        for name in ['start.i8'] + [f'{stat}.{dtype[0]}4' for stat, dtype in STATS]:
+            open(os.path.join(tmp, f'L{seconds}', name), 'wb').close()
+    meta = {'levels': list(levels), 'channels': list(channels), 'buckets': [0] * len(levels),
+            'rows': 0, 'first': None, 'last': None, 'source': source}
+    if len(time):
+        _write(tmp, meta, time, channels, 0, np.iinfo('int64').min)
+    else:
+        write_meta(tmp, meta)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+
+# Whether the pyramid described by `meta` (None: there is none) can't be
+# extended to `time` and `channels` and has to be rebuilt
+def _stale(meta, time, channels, levels, source):
+    rows = meta['rows'] if meta else 0
+    return (meta is None or rows == 0 or len(time) < rows
+            or meta['channels'] != list(channels) or meta['levels'] != list(levels)
+            or meta.get('source') != source
+            or int(time[0]) != meta['first'] or int(time[rows - 1]) != meta['last'])
+
+
+# Bring the pyramid at `path` up to date with `time` and `channels`. Samples
+# appended after the ones it was built from only recompute the last coarsest
+# bucket onwards; anything else (first build, other channels or levels,
+# rewritten history, a different `source` string identifying data that the
+# times alone don't) rebuilds it. Returns the number of samples read.
+def sync(path, time, channels, levels=LEVELS, source=None):
+    time = _as_ns(time)
+    n = len(time)
+    meta = read_meta(path) if exists(path) else None
+    if not _stale(meta, time, channels, levels, source) and meta['rows'] == n:
+        return 0
+    with locked(path):
+        meta = read_meta(path) if exists(path) else None
+        if _stale(meta, time, channels, levels, source):
+            build(path, time, channels, levels, source)
+            return n
+        if n == meta['rows']:
+            return 0
+        top = levels[-1] * NS
+        cutoff = meta['last'] // top * top
+        lo = int(np.searchsorted(time, cutoff, side='left'))
+        _write(path, meta, time, channels, lo, cutoff)
+        return n - lo
+
+
+def _open(path, name, dtype, shape):
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(os.path.join(path, name), dtype=dtype, mode='r', shape=shape)
+
+
+class Pyramid:
+    def __init__(self, path):
+        self.path = path
+        self.reload()
+
+    # (Re)open every level at the bucket counts in meta.json
+    def reload(self):
+        meta = read_meta(self.path)
+        self.levels = meta['levels']
+        self.channels = meta['channels']
+        self.start = {}
+        self.stats = {}
+        for seconds, buckets in zip(self.levels, meta['buckets']):
+            level_dir = os.path.join(self.path, f'L{seconds}')
+            self.start[seconds] = _open(level_dir, 'start.i8', 'int64', (buckets,))
+            self.stats[seconds] = {stat: _open(level_dir, f'{stat}.{dtype[0]}4', dtype,
+                                               (buckets, len(self.channels)))
+                                   for stat, dtype in STATS}
+
+    # Bucket range [i, j) of a level overlapping start_ns..end_ns
+    def span(self, seconds, start_ns, end_ns):
+        start = self.start[seconds]
+        i = int(np.searchsorted(start, start_ns - seconds * NS, side='right'))
+        j = int(np.searchsorted(start, end_ns, side='right'))
+        return i, j
+
+    # Finest level with at most max_buckets buckets in start_ns..end_ns (the
+    # coarsest if none has)
+    def pick(self, start_ns, end_ns, max_buckets=MAX_BUCKETS):
+        for seconds in self.levels:
+            i, j = self.span(seconds, start_ns, end_ns)
+            if j - i <= max_buckets:
+                return seconds
+        return self.levels[-1]
+
+    # (start, min, max, mean) of one channel over buckets [i, j) of a level
+    def read(self, seconds, channel, i, j):
+        c = self.channels.index(channel)
+        stats = self.stats[seconds]
+        return (np.asarray(self.start[seconds][i:j]), np.asarray(stats['min'][i:j, c]),
+                np.asarray(stats['max'][i:j, c]), np.asarray(stats['mean'][i:j, c]))
+
+    # (min, max) of one channel over start_ns..end_ns, read from the level
+    # pick() chooses, so exact up to that level's bucket edges
+    def range(self, channel, start_ns, end_ns, max_buckets=MAX_BUCKETS):
+        seconds = self.pick(start_ns, end_ns, max_buckets)
+        _, low, high, _ = self.read(seconds, channel, *self.span(seconds, start_ns, end_ns))
+        if not len(low) or np.all(np.isnan(low)):
+            return np.nan, np.nan
+        return float(np.nanmin(low)), float(np.nanmax(high))
+
+
+if __name__ == '__main__':
+    import samplestore
+
+    parser = argparse.ArgumentParser(description="Build or update the pyramid of a wrist-motion sample store")
+    parser.add_argument('--samples', required=True, help="sample store directory")
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+    samples = samplestore.SampleStore(args.samples)
+    read = sync(args.out, samples.time, {c: samples.values[c] for c in samples.channels})
+    print(f"{read} samples read -> {args.out}")
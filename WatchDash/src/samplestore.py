@@ -0,0 +1,231 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import numpy as np
+import timestamps
+
+# Memory-mapped sample store for the Apple Watch wrist-motion channels.
+#   time.i8         sorted int64 epoch ns, one per sample
+#   <channel>.f4    float32 samples of one channel, contiguous
+#   blocks.i8       every BLOCK-th timestamp (sparse index, kept in RAM)
+#   meta.json       row count, channel order, block size, the byte offset
+#                   of the first WristMotion.csv line not yet in the store,
+#                   and the [start, end] window it was built over (null: all
+#                   of the watch data)
+# Files are opened read-only with np.memmap, so several dashboard processes
+# share the same pages through the OS page cache. Appends write past the end
+# of each file and only become visible once meta.json is replaced.
+# Dashboards open the store with load(), which builds it over all of the
+# watch data; they slice their own dates out of it with date_range(), so
+# dashboards with different date windows can share one store. Building,
+# appending and updating hold <path>.lock, so processes starting or
+# refreshing together take turns instead of interleaving their writes; a
+# process that finds the store up to date attaches without taking it.
+
+CHANNELS = [
+    'rotationRateX', 'rotationRateY', 'rotationRateZ',
+    'gravityX', 'gravityY', 'gravityZ',
+    'accelerationX', 'accelerationY', 'accelerationZ',
+    'quaternionW', 'quaternionX', 'quaternionY', 'quaternionZ',
+]
+BLOCK = 4096
+
+
+def exists(path):
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+
+# Exclusive lock on the store at `path` while it is written. It is a sibling
+# file because build() replaces the directory.
+@contextlib.contextmanager
+def locked(path):
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+# Write `frames` (WatchWrangle frames or read_chunks chunks, in time order)
+# to `path`, covering the dates `window` (None: all of them), and return the
+# number of samples. Each frame is appended as it comes, so only one is held
+# at a time. The store is built in a temporary directory and renamed into
+# place so readers never see a partial store. Call it holding locked(path).
+def build(path, frames, channels=CHANNELS, block=BLOCK, csv_offset=0, window=None):
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in ['time.i8', 'blocks.i8'] + [f'{c}.f4' for c in channels]:
+        open(os.path.join(tmp, name), 'wb').close()
+    write_meta(tmp, {'rows': 0, 'channels': list(channels), 'block': block,
+                     'csv_offset': 0, 'window': window})
+    for df in frames:
+        append(tmp, df)
+    meta = read_meta(tmp)
+    meta['csv_offset'] = csv_offset
+    write_meta(tmp, meta)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+    return meta['rows']
+
+
+# Append samples newer than the last stored timestamp. Rows at or before it
+# are dropped here, which is where overlapping reads get de-duplicated.
+def append(path, df, csv_offset=None):
+    meta = read_meta(path)
+    rows, block = meta['rows'], meta['block']
+
+    t = df['time'].to_numpy('int64')
+    order = np.argsort(t, kind='stable')
+    t = t[order]
+    if rows:
+        last = np.fromfile(os.path.join(path, 'time.i8'), dtype='int64',
+                           count=1, offset=(rows - 1) * 8)[0]
+        keep = t > last
+        t, order = t[keep], order[keep]
+
+    # Drop anything past `rows` left behind by an interrupted append
+    os.truncate(os.path.join(path, 'time.i8'), rows * 8)
+    os.truncate(os.path.join(path, 'blocks.i8'), -(-rows // block) * 8)
+    with open(os.path.join(path, 'time.i8'), 'ab') as f:
+        t.tofile(f)
+    with open(os.path.join(path, 'blocks.i8'), 'ab') as f:
+        t[(-rows) % block::block].tofile(f)
+    for channel in meta['channels']:
+        file_path = os.path.join(path, f'{channel}.f4')
+        os.truncate(file_path, rows * 4)
+        with open(file_path, 'ab') as f:
+            df[channel].to_numpy('float32')[order].tofile(f)
+
+    meta['rows'] = rows + len(t)
+    if csv_offset is not None:
+        meta['csv_offset'] = csv_offset
+    write_meta(path, meta)
+    return len(t)
+
+
+# Append the lines written to WristMotion.csv since the stored byte offset.
+# Like build() and append(), call it holding locked(path).
+def update(path, csv_path):
+    import WatchWrangle
+
+    df, offset = WatchWrangle.WatchSince(csv_path, read_meta(path)['csv_offset'])
+    return append(path, df, offset)
+
+
+# The store at `path`, built over all of the watch data (from the session
+# store's day partitions if it holds it, else the CSV's chunks) if it is
+# missing or was built over a date window, then extended with the CSV lines
+# written since
+def load(path, csv_path, session_store=None):
+    import WatchWrangle
+
+    if exists(path):
+        meta = read_meta(path)
+        if meta.get('window', 'unknown') is None and meta['csv_offset'] == WatchWrangle.line_end_offset(csv_path):
+            return SampleStore(path)
+    with locked(path):
+        if not exists(path) or read_meta(path).get('window', 'unknown') is not None:
+            csv_offset = WatchWrangle.line_end_offset(csv_path)
+            frames = WatchWrangle.read_chunks(csv_path)
+            if session_store:
+                import sessionstore
+                import watermarks
+                if sessionstore.list_days(session_store, 'watch'):
+                    # Rows served from the session store only reach its watch
+                    # mark, which ingest saves after writing them; the CSV
+                    # lines past it are picked up by update() below. Read it
+                    # first.
+                    marks = watermarks.load(os.path.join(session_store, sessionstore.MARKS_FILE))
+                    csv_offset = marks.get('watch', 0)
+                    frames = sessionstore.iter_sensor(session_store, 'watch')
+            build(path, frames, csv_offset=csv_offset)
+        update(path, csv_path)
+    return SampleStore(path)
+
+
+class SampleStore:
+    def __init__(self, path):
+        self.path = path
+        self.reload()
+
+    # (Re)open the files at the row count in meta.json, picking up appends
+    def reload(self):
+        meta = read_meta(self.path)
+        self.channels = meta['channels']
+        self.block = meta['block']
+        rows = meta['rows']
+        if rows:
+            self.time = np.memmap(os.path.join(self.path, 'time.i8'), dtype='int64',
+                                  mode='r', shape=(rows,))
+            self.values = {c: np.memmap(os.path.join(self.path, f'{c}.f4'), dtype='float32',
+                                        mode='r', shape=(rows,))
+                           for c in self.channels}
+        else:
+            self.time = np.empty(0, dtype='int64')
+            self.values = {c: np.empty(0, dtype='float32') for c in self.channels}
+        self.blocks = np.fromfile(os.path.join(self.path, 'blocks.i8'), dtype='int64',
+                                  count=-(-rows // self.block))
+
+    def __len__(self):
+        return len(self.time)
+
+    # Position of `value` in the sorted time array: the sparse index picks the
+    # one block it can fall in, so only that block's pages are touched.
+    def _bound(self, value, side):
+        k = np.searchsorted(self.blocks, value, side=side) - 1
+        if k < 0:
+            return 0
+        start = k * self.block
+        return start + int(np.searchsorted(self.time[start:start + self.block], value, side=side))
+
+    # Row range [lo, hi) with start_ns <= time <= end_ns
+    def locate(self, start_ns, end_ns):
+        return self._bound(start_ns, 'left'), self._bound(end_ns, 'right')
+
+    # Row range for Phoenix-local dates/datetimes (either may be None)
+    def date_range(self, start_date=None, end_date=None):
+        lo = self._bound(timestamps.local_to_epoch(start_date, 'ns'), 'left') if start_date else 0
+        hi = self._bound(timestamps.local_to_epoch(end_date, 'ns'), 'right') if end_date else len(self)
+        return lo, hi
+
+    # Zero-copy view of one channel
+    def channel(self, name, lo=0, hi=None):
+        return self.values[name][lo:hi]
+
+
+if __name__ == '__main__':
+    import WatchWrangle
+
+    parser = argparse.ArgumentParser(description="Build or extend the wrist-motion sample store")
+    parser.add_argument('command', choices=['build', 'update'])
+    parser.add_argument('--watch', required=True, help="path to WristMotion.csv")
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    args = parser.parse_args()
+    with locked(args.out):
+        if args.command == 'update' and exists(args.out):
+            print(f"{update(args.out, args.watch)} new samples -> {args.out}")
+        else:
+            offset = WatchWrangle.line_end_offset(args.watch)
+            start_ns = timestamps.local_to_epoch(args.start, 'ns') if args.start else None
+            end_ns = timestamps.local_to_epoch(args.end, 'ns') if args.end else None
+            window = [args.start, args.end] if args.start or args.end else None
+            rows = build(args.out, WatchWrangle.read_chunks(args.watch, start_ns, end_ns),
+                         csv_offset=offset, window=window)
+            print(f"{rows} samples -> {args.out}")
@@ -0,0 +1,92 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+# Start-up report for the dashboards. Each one is launched in a fresh Python
+# process from its src directory (so the OS page cache is the only thing
+# shared between runs) and three times are taken from process launch:
+#   import     `import main` finished: layout built, no data read yet
+#   response   first HTTP 200 for the page and its layout
+#   data       the background load finished (or failed)
+#
+#   python3 startup_report.py                      all dashboards
+#   python3 startup_report.py ComboDash WatchDash  just these
+DASHBOARDS = ['BabDash', 'ComboDash', 'DashRidgePCA', 'DashViz', 'GPTZeppU',
+              'GPUDashViz', 'MiiViz', 'TennisDash', 'WatchDash']
+
+CHILD = """
+import sys, threading, time
+began = time.perf_counter()
+import main
+print('import', time.perf_counter() - began, flush=True)
+def report():
+    main.data.start()
+    main.data.done.wait()
+    status = 'ok' if main.data.error is None else type(main.data.error).__name__
+    print('data', time.perf_counter() - began, status, flush=True)
+threading.Thread(target=report, daemon=True).start()
+main.app.run(port=int(sys.argv[1]), debug=False)
+"""
+
+
+def measure(src, port, timeout):
+    began = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', CHILD, str(port)], cwd=src,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    result = {}
+    data_done = threading.Event()
+
+    def read_stdout():
+        for line in proc.stdout:
+            fields = line.split()
+            if fields and fields[0] == 'import':
+                result['import'] = float(fields[1])
+            elif fields and fields[0] == 'data':
+                result['data'] = float(fields[1])
+                result['status'] = fields[2]
+                data_done.set()
+        data_done.set()
+
+    threading.Thread(target=read_stdout, daemon=True).start()
+    try:
+        while 'response' not in result and time.perf_counter() - began < timeout:
+            if proc.poll() is not None:
+                result.setdefault('status', f'exited {proc.returncode}')
+                break
+            try:
+                for path in ['/', '/_dash-layout']:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=1).read()
+                result['response'] = time.perf_counter() - began
+            except OSError:
+                time.sleep(0.02)
+        data_done.wait(max(0.0, timeout - (time.perf_counter() - began)))
+    finally:
+        proc.kill()
+        proc.wait()
+    return result
+
+
+def format_report(rows):
+    lines = [f"{'dashboard':<14}{'import':>9}{'response':>10}{'data':>9}  status"]
+    for name, r in rows:
+        cells = [f"{r[k]:>8.2f}s" if k in r else f"{'-':>9}" for k in ['import', 'response', 'data']]
+        cells[1] = ' ' + cells[1]
+        lines.append(f"{name:<14}{''.join(cells)}  {r.get('status', 'timeout')}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure dashboard import time and time to first response")
+    parser.add_argument('dashboards', nargs='*', default=DASHBOARDS)
+    parser.add_argument('--port', type=int, default=8061)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+    root = os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    for name in args.dashboards:
+        rows.append((name, measure(os.path.join(root, name, 'src'), args.port, args.timeout)))
+    print(format_report(rows))